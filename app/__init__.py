@@ -1,29 +1,42 @@
+import logging
+from logging.handlers import SMTPHandler, RotatingFileHandler
+import os
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
 from config import Config
 from flask_bootstrap import Bootstrap
-from flask_moment import Moment
 # from flask_babel import Babel
 # from flask import request
 
-# line below (and from app inport routes) is all you need for a basic app
-app = Flask(__name__)
-# creates the application object as an instance of class Flask imported from the flask package.
-
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login = LoginManager(app) # ensures content cannot be viewed if user is not logged in.
-login.login_view = 'login'
-# The 'login' value above is the function (or endpoint) name for the login view. In other words, 
-# the name you would use in a url_for() call to get the URL.
-mail = Mail(app)
-bootstrap = Bootstrap(app)
-moment = Moment(app) # unlike other extensions, moment works with moment.js
-# Moment.js makes a moment class available to the browser.
+'''
+Application factory.
+
+The extensions are created here without an application and bound to one in create_app(),
+so that tests (and scripts) can build as many applications as they need, each with its
+own configuration. Modules that need the application use flask's current_app.
+
+Nothing expensive happens at import time anymore:
+
+* Flask-Migrate pulls in all of Alembic, and is only needed by the "flask db" commands, so
+  it is only set up when the application is made by the flask command.
+* Flask-Moment (which imports distutils) is only needed to render pages, and the file and
+  email logging handlers only matter to a web worker, so both are set up right before the
+  first request is handled.
+
+(venv) $ python -m benchmarks.startup
+'''
+
+db = SQLAlchemy()
+login = LoginManager() # ensures content cannot be viewed if user is not logged in.
+login.login_view = 'auth.login'
+# The 'auth.login' value above is the function (or endpoint) name for the login view,
+# prefixed with the name of its blueprint. In other words, the name you would use in a
+# url_for() call to get the URL.
+mail = Mail()
+bootstrap = Bootstrap()
 
 # for translating the text into various languages
 # babel = Babel(app)
@@ -32,22 +45,47 @@ moment = Moment(app) # unlike other extensions, moment works with moment.js
 #     return request.accept_languages.best_match(app.config['LANGUAGES'])
 
 
-# app is the package; routes, models, etc. are the modules
-from app import routes, models, errors, forms
-'''
-One aspect that may seem confusing at first is that there are two entities named app. 
-The app package is defined by the app directory and the __init__.py script, and is 
-referenced in the from app import routes statement. The app variable is defined as an 
-instance of class Flask in the __init__.py script, which makes it a member of the app 
-package.
-'''
-
-import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
-import os
-
-
-if not app.debug: # below is for logging errors
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    # creates the application object as an instance of class Flask imported from the flask package.
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    login.init_app(app)
+    mail.init_app(app)
+    bootstrap.init_app(app)
+    if click.get_current_context(silent=True) is not None: # made by the flask command
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    @app.before_first_request
+    def setup_web_worker():
+        from flask_moment import Moment
+        Moment(app) # unlike other extensions, moment works with moment.js
+        # Moment.js makes a moment class available to the browser.
+        configure_logging(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp) # no prefix, links in emails already sent must keep working
+    from app.main import bp as main_bp
+    app.register_blueprint(main_bp)
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api')
+    from app import cli
+    cli.register(app)
+    # blueprints that mostly add request hooks and template globals to the whole app (metrics
+    # also serves /metrics)
+    from app import conditional, fragments, metrics, recent, sampling_profiler, sql_profiler
+    for module in (conditional, fragments, metrics, recent, sampling_profiler, sql_profiler):
+        app.register_blueprint(module.bp)
+    return app
+
+
+def configure_logging(app):
+    if app.debug or app.testing: # below is for logging errors
+        return
     if not os.path.exists('logs'):
         os.mkdir('logs')
     file_handler = RotatingFileHandler('logs/microblog.log', maxBytes=10240,
@@ -77,19 +115,19 @@ if not app.debug: # below is for logging errors
         app.logger.addHandler(mail_handler)
 
 '''
-the code above creates a SMTPHandler instance, sets its level so that it only reports 
-errors and not warnings, informational or debugging messages, and finally attaches it 
+the code above creates a SMTPHandler instance, sets its level so that it only reports
+errors and not warnings, informational or debugging messages, and finally attaches it
 to the app.logger object from Flask.
 
-There are two approaches to test this feature. The easiest one is to use the SMTP 
-debugging server from Python. This is a fake email server that accepts emails, but 
-instead of sending them, it prints them to the console. To run this server, open a 
+There are two approaches to test this feature. The easiest one is to use the SMTP
+debugging server from Python. This is a fake email server that accepts emails, but
+instead of sending them, it prints them to the console. To run this server, open a
 second terminal session and run the following command on it:
 
 (venv) $ python -m smtpd -n -c DebuggingServer localhost:8025
 
-Leave the debugging SMTP server running and go back to your first terminal and set 
-MAIL_SERVER=localhost and and MAIL_PORT=8025 in the environment. Make sure the FLASK_DEBUG 
+Leave the debugging SMTP server running and go back to your first terminal and set
+MAIL_SERVER=localhost and and MAIL_PORT=8025 in the environment. Make sure the FLASK_DEBUG
 variable is set to 0
 
 SETTINGS FOR GMAIL
@@ -99,11 +137,11 @@ SETTINGS FOR GMAIL
 (venv) $ set MAIL_USERNAME=<your-gmail-username>
 (venv) $ set MAIL_PASSWORD=<your-gmail-password>
 
-Remember that the security features in your Gmail account may prevent the application from 
-sending emails through it unless you explicitly allow "less secure apps" access to your Gmail 
+Remember that the security features in your Gmail account may prevent the application from
+sending emails through it unless you explicitly allow "less secure apps" access to your Gmail
 account.
 
-(venv) $ flask shell 
+(venv) $ flask shell
 
 >>> from flask_mail import Message
 >>> from app import mail
@@ -112,4 +150,12 @@ account.
 >>> msg.body = 'text body'
 >>> msg.html = '<h1>HTML body</h1>'
 >>> mail.send(msg)
-'''
\ No newline at end of file
+'''
+
+# app is the package; models is one of its modules
+from app import models
+'''
+One aspect that may seem confusing at first is that there are two entities named app.
+The app package is defined by the app directory and the __init__.py script. The
+application is an instance of class Flask made by create_app(), each caller keeps its own.
+'''
@@ -0,0 +1,79 @@
+import json
+from flask import Blueprint, Response, current_app, stream_with_context
+from flask_login import login_required
+from app import db
+from app.models import User, Post, followers
+
+'''
+Export API for the analytics jobs, which used to scrape the /user/<username> pages.
+
+Each endpoint streams one JSON object per line (NDJSON). The rows are read as plain column
+tuples through a server side cursor (stream_results, yield_per), so nothing piles up in the
+session and memory stays flat however many rows there are, and every line is sent as soon
+as it is read, so the first bytes go out right away. The rows come in keyset order, posts
+by (timestamp, id) and users by id, which are exactly the orders of the indexes the queries
+use, so the database never has to sort either.
+
+(venv) $ curl -b cookies.txt http://localhost:5000/api/users/susan/posts
+{"id":1,"body":"my first post","timestamp":"2018-01-02T10:20:30.123456Z"}
+...
+'''
+
+
+def ndjson(query, serialize):
+    '''streams the rows of query, one line per row'''
+    rows = query.execution_options(stream_results=True).yield_per(
+        current_app.config['EXPORT_CHUNK_SIZE'])
+
+    def generate():
+        for row in rows:
+            yield json.dumps(serialize(row), separators=(',', ':')) + '\n'
+    # stream_with_context keeps the request (and its database session) open while the
+    # generator runs, after the view itself has returned
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def posts_query(user):
+    return db.session.query(Post.id, Post.body, Post.timestamp).filter(
+        Post.user_id == user.id).order_by(Post.timestamp, Post.id)
+
+
+def followers_query(user):
+    return db.session.query(User.id, User.username).join(
+        followers, followers.c.follower_id == User.id).filter(
+        followers.c.followed_id == user.id).order_by(followers.c.follower_id)
+
+
+def following_query(user):
+    return db.session.query(User.id, User.username).join(
+        followers, followers.c.followed_id == User.id).filter(
+        followers.c.follower_id == user.id).order_by(followers.c.followed_id)
+
+
+def export_user(row):
+    return {'id': row.id, 'username': row.username}
+
+
+bp = Blueprint('api', __name__) # registered with url_prefix='/api'
+
+
+@bp.route('/users/<username>/posts')
+@login_required
+def export_posts(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return ndjson(posts_query(user), lambda row: {
+        'id': row.id, 'body': row.body, 'timestamp': row.timestamp.isoformat() + 'Z'})
+
+
+@bp.route('/users/<username>/followers')
+@login_required
+def export_followers(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return ndjson(followers_query(user), export_user)
+
+
+@bp.route('/users/<username>/following')
+@login_required
+def export_following(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return ndjson(following_query(user), export_user)
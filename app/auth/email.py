@@ -0,0 +1,21 @@
+from flask import render_template, current_app
+from app.email import send_email
+
+
+def send_password_reset_email(user):
+    '''
+    The interesting part in this function is that the text and HTML content for the emails 
+    is generated from templates using the familiar render_template() function. The templates
+    receive the user and the token as arguments, so that a personalized email message can be 
+    generated.
+    '''
+    token = user.get_reset_password_token()
+    send_email('[Microblog] Reset Your Password',
+            sender=current_app.config['ADMINS'][0],
+            recipients=[user.email],
+            text_body=render_template('email/reset_password.txt',
+            user=user, token=token),
+            html_body=render_template('email/reset_password.html',
+            user=user, token=token))
+
+
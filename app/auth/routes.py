@@ -0,0 +1,97 @@
+from flask import render_template, flash, redirect, url_for, request
+from flask_login import login_user, logout_user, current_user
+from werkzeug.urls import url_parse
+from app import db
+from app.auth import bp
+from app.auth.forms import LoginForm, RegistrationForm, ResetPasswordRequestForm, \
+    ResetPasswordForm
+from app.auth.email import send_password_reset_email
+from app.models import User, user_cache
+
+'''
+Logging in and out, registering and resetting a forgotten password. The blueprint is
+registered without a url_prefix, so these pages keep the URLs they had before the
+blueprints (/login, /register, ...), and the reset links in emails already sent still work.
+'''
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = LoginForm()
+    if form.validate_on_submit():
+        # SCAFFOLDING
+        # user = {'username', 'Michael'}
+        user = User.query.filter_by(username=form.username.data).first()
+        if user is None or not user.check_password(form.password.data):
+            flash('Invalid username or password')
+            return redirect(url_for('auth.login'))
+        if user.needs_rehash(): # upgrade the stored hash to the configured cost
+            user.set_password(form.password.data)
+            db.session.commit()
+            user_cache.invalidate(user.id)
+        login_user(user, remember=form.remember_me.data)
+        next_page = request.args.get('next')
+        if not next_page or url_parse(next_page).netloc != '':
+            next_page = url_for('main.index')
+        return redirect(next_page)
+    return render_template('login.html', title='Sign In', form=form)
+
+
+@bp.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('main.index'))
+
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        user = User(username=form.username.data, email=form.email.data)
+        user.set_password(form.password.data)
+        db.session.add(user)
+        db.session.commit()
+        flash('Congratulations, you are now a registered user!')
+        return redirect(url_for('auth.login'))
+    return render_template('register.html', title='Register', form=form)
+
+@bp.route('/reset_password_request', methods=['GET', 'POST'])
+def reset_password_request():
+    '''
+    After the email is sent, I flash a message directing the user to look for the email for further 
+    instructions, and then redirect back to the login page. You may notice that the flashed message 
+    is displayed even if the email provided by the user is unknown. This is so that clients cannot 
+    use this form to figure out if a given user is a member or not.
+    '''
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = ResetPasswordRequestForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(email=form.email.data).first()
+        if user:
+            send_password_reset_email(user)
+        flash('Check your email for the instructions to reset your password')
+        return redirect(url_for('auth.login'))
+    return render_template('reset_password_request.html',
+                           title='Reset Password', form=form)
+
+
+@bp.route('/reset_password/<token>', methods=['GET', 'POST'])
+def reset_password(token):
+    if current_user.is_authenticated: #Make sure user isn't logged in
+        return redirect(url_for('main.index'))
+    user = User.verify_reset_password_token(token) # verify token returning user
+    if not user:
+        return redirect(url_for('main.index')) # if the token was not verified, returned None
+    form = ResetPasswordForm()
+    if form.validate_on_submit():
+        user.set_password(form.password.data)
+        db.session.commit()
+        user_cache.invalidate(user.id)
+        flash('Your password has been reset.')
+        return redirect(url_for('auth.login'))
+    return render_template('reset_password.html', form=form)
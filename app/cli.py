@@ -0,0 +1,117 @@
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app import db
+from app.bulk import import_data, generate_data
+from app.digest import send_digests
+from app.models import User, Post
+
+'''
+Custom "flask" commands. They are collected on the commands group below and register()
+adds each of them straight to app.cli, so they show up in "flask --help" next to the
+built-in run, shell and db commands. Like every command of an AppGroup they run in an
+application context made by create_app().
+'''
+
+
+commands = AppGroup('microblog') # only holds the commands, see register()
+
+
+def register(app):
+    for command in commands.commands.values():
+        app.cli.add_command(command)
+
+
+@commands.command('reconcile-counters')
+@click.option('--chunk-size', default=1000, help='Users updated per transaction.')
+def reconcile_counters(chunk_size):
+    """Recompute the follower, following and post counters of every user."""
+    last_id = 0
+    while True:
+        last_id = User.reconcile_counters(last_id, chunk_size)
+        if last_id is None:
+            break
+        db.session.commit() # one short transaction per chunk
+        click.echo('reconciled users up to id {}'.format(last_id))
+    click.echo('done')
+
+
+@commands.command('send-digest')
+@click.option('--days', default=7, help='Only include posts from the last DAYS days.')
+@click.option('--chunk-size', default=None, type=int, help='Users read per query.')
+@click.option('--checkpoint', default=lambda: current_app.config['DIGEST_CHECKPOINT'],
+              help='File that remembers how far an interrupted run got.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start over.')
+def send_digest(days, chunk_size, checkpoint, restart):
+    """Email every user a digest of the posts they missed."""
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    sent = send_digests(days=days, chunk_size=chunk_size, checkpoint=checkpoint,
+                        log=click.echo)
+    click.echo('sent {} digests'.format(sent))
+
+
+@commands.command('rebuild-search-index')
+@click.option('--batch-size', default=5000, help='Posts indexed per transaction.')
+def rebuild_search_index(batch_size):
+    """Rebuild the full-text search index of the posts from scratch."""
+    db.session.execute("INSERT INTO post_fts (post_fts) VALUES ('delete-all')")
+    last_id = 0
+    while True:
+        last_id = Post.rebuild_search_index(last_id, batch_size)
+        db.session.commit()
+        if last_id is None:
+            break
+        click.echo('indexed posts up to id {}'.format(last_id))
+    click.echo('done')
+
+
+@commands.command('rebuild-timelines')
+@click.option('--chunk-size', default=100, help='Users rebuilt per transaction.')
+def rebuild_timelines(chunk_size):
+    """Rebuild every user's home timeline from the posts and the follow graph."""
+    last_id = 0
+    while True:
+        last_id = User.rebuild_timelines(last_id, chunk_size)
+        if last_id is None:
+            break
+        db.session.commit()
+        click.echo('rebuilt timelines up to user id {}'.format(last_id))
+    click.echo('done')
+
+
+@commands.command('import-data')
+@click.option('--users', type=click.Path(exists=True), help='Users file (.jsonl or .csv).')
+@click.option('--posts', type=click.Path(exists=True), help='Posts file (.jsonl or .csv).')
+@click.option('--followers', type=click.Path(exists=True),
+              help='Follow edges file (.jsonl or .csv).')
+@click.option('--chunk-size', default=None, type=int, help='Rows inserted per transaction.')
+@click.option('--default-password', default=None,
+              help='Password for the users that have no password_hash.')
+@click.option('--timeline-days', default=None, type=int,
+              help='Only put the posts of the last DAYS days in the home timelines '
+                   '(IMPORT_TIMELINE_DAYS by default, 0 for all posts).')
+def import_data_command(users, posts, followers, chunk_size, default_password, timeline_days):
+    """Bulk load users, posts and follow edges, then rebuild counters and timelines."""
+    counts = import_data(users, posts, followers, chunk_size=chunk_size,
+                         default_password=default_password, timeline_days=timeline_days,
+                         log=click.echo)
+    for table, count in counts.items():
+        click.echo('imported {} {} rows'.format(count, table))
+
+
+@commands.command('generate-data')
+@click.argument('directory')
+@click.option('--users', default=100000, help='Number of users.')
+@click.option('--posts', default=10000000, help='Number of posts.')
+@click.option('--edges', default=5000000, help='About how many follow edges.')
+@click.option('--days', default=30, help='Posts are spread over the last DAYS days.')
+@click.option('--alpha', default=1.0, help='Power law exponent of the popularity.')
+@click.option('--format', type=click.Choice(['jsonl', 'csv']), default='jsonl')
+@click.option('--seed', default=None, type=int, help='Random seed, for repeatable data.')
+def generate_data_command(directory, users, posts, edges, days, alpha, format, seed):
+    """Write a synthetic dataset for import-data to DIRECTORY."""
+    paths = generate_data(directory, users=users, posts=posts, edges=edges, days=days,
+                          alpha=alpha, format=format, seed=seed, log=click.echo)
+    click.echo('flask import-data --users {} --posts {} --followers {}'.format(*paths))
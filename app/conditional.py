@@ -0,0 +1,68 @@
+from datetime import datetime
+from hashlib import md5
+from time import time
+from flask import Blueprint, current_app, g, request, session, make_response
+
+'''
+Conditional GET for the feed pages (index, user and explore).
+
+Before running the feed query, a view builds a validator from a few cheap values: the
+newest post the page could show, the counters and profile_version of the users on it and
+the id and follow_version of the viewer (so following someone changes the validator without
+loading the list of followed users). Its md5 is sent as the ETag, and the time of the newest post as
+Last-Modified. When the browser asks again with If-None-Match and nothing moved, the view
+answers 304 Not Modified without querying or rendering anything.
+
+Last-Modified is only informational. A follow, an unfollow or a new username changes the
+page without making it newer, so a request with only If-Modified-Since is always answered
+with the full page (RFC 7232 lets a server ignore it when it cannot be trusted).
+
+The pages are different for every viewer, so they are marked private and Vary: Cookie,
+and no-cache makes the browser revalidate on every visit instead of guessing.
+
+A few things are on the page but not in the validator: the CSRF token of the post form,
+the trending panel and the names of the other authors. The validator also includes the
+current PAGE_VALIDATOR_TTL slice of time, so none of them is ever older than that. When a
+flashed message is waiting in the session the page is always rendered (and not given an
+ETag), otherwise the browser would keep showing the cached copy and the message would be
+lost, or show the old message again later.
+'''
+
+
+def validator_bucket():
+    '''start of the current slice of PAGE_VALIDATOR_TTL seconds'''
+    now = time()
+    return int(now - now % current_app.config['PAGE_VALIDATOR_TTL'])
+
+
+def conditional_get(parts, last_modified=None):
+    '''
+    Returns a 304 response when the client's copy of the page matches parts, or None when
+    the view has to render it. Either way the rendered page gets the validator headers.
+    '''
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    bucket = validator_bucket()
+    parts = list(parts) + [bucket, session.get('csrf_token'), request.full_path]
+    etag = md5(repr(parts).encode('utf-8')).hexdigest()
+    last_modified = max(last_modified or datetime.min, datetime.utcfromtimestamp(bucket))
+    last_modified = last_modified.replace(microsecond=0) # HTTP dates have no fractions
+    g.page_validator = (etag, last_modified)
+    if request.if_none_match.contains(etag): # not If-Modified-Since, see the docstring above
+        return make_response('', 304)
+    return None
+
+
+bp = Blueprint('conditional', __name__)
+
+
+@bp.after_app_request
+def add_validator_headers(response):
+    validator = g.get('page_validator')
+    if validator is not None and response.status_code in (200, 304):
+        response.set_etag(validator[0])
+        response.last_modified = validator[1]
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+    return response
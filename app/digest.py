@@ -0,0 +1,116 @@
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from app import db
+from app.email import send_email, mail_queue
+from app.models import User, Post, followers
+
+'''
+"What you missed" digest emails, sent by the "flask send-digest" command.
+
+The pipeline never holds more than one chunk of users in memory:
+
+1. users are read in id order, DIGEST_CHUNK_SIZE at a time (keyset, not OFFSET), as plain
+   column tuples so nothing piles up in the session's identity map
+2. for the whole chunk, a single query finds the posts written by the people each user
+   follows since they were last seen, numbered per user with a window function so only the
+   newest few per user come back, together with the total count
+3. each email is rendered from templates compiled once for the whole run and handed to the
+   mail queue, whose workers reuse their SMTP connections (and whose bounded size slows this
+   loop down if SMTP cannot keep up)
+4. once every email of the chunk has left the mail queue (sent, or given up on after the
+   retries), the id of the last user in the chunk is written to a checkpoint file, so a run
+   that is interrupted, even by a kill that loses what is still queued, resumes after the
+   last chunk that was delivered
+'''
+
+DigestPost = namedtuple('DigestPost', ['author', 'body', 'timestamp'])
+
+
+def user_chunks(after_id, chunk_size):
+    while True:
+        chunk = db.session.query(User.id, User.username, User.email, User.last_seen).filter(
+            User.id > after_id, User.email.isnot(None)).order_by(User.id).limit(
+                chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        after_id = chunk[-1].id
+
+
+def missed_posts(user_ids, since, per_user):
+    '''
+    {user id: (number of new posts, [newest per_user posts])} for the users in user_ids,
+    counting posts newer than both the user's last_seen and since.
+    '''
+    reader = db.aliased(User)
+    author = db.aliased(User)
+    ranked = db.session.query(
+        followers.c.follower_id.label('user_id'),
+        author.username.label('author'),
+        Post.body.label('body'),
+        Post.timestamp.label('timestamp'),
+        db.func.row_number().over(
+            partition_by=followers.c.follower_id,
+            order_by=(Post.timestamp.desc(), Post.id.desc())).label('rank'),
+        db.func.count().over(partition_by=followers.c.follower_id).label('total')).select_from(
+            followers).join(Post, Post.user_id == followers.c.followed_id).join(
+            reader, reader.id == followers.c.follower_id).join(
+            author, author.id == Post.user_id).filter(
+            followers.c.follower_id.in_(user_ids),
+            Post.timestamp > since,
+            db.or_(reader.last_seen.is_(None), Post.timestamp > reader.last_seen)).subquery()
+    missed = {}
+    for row in db.session.query(ranked).filter(ranked.c.rank <= per_user).order_by(
+            ranked.c.user_id, ranked.c.rank):
+        missed.setdefault(row.user_id, (row.total, []))[1].append(
+            DigestPost(row.author, row.body, row.timestamp))
+    return missed
+
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    return 0
+
+
+def write_checkpoint(path, last_id):
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(last_id))
+        os.replace(path + '.tmp', path) # atomic, a crash never leaves a half written file
+
+
+def send_digests(days=7, chunk_size=None, per_user=5, checkpoint=None, log=None):
+    '''sends the digest to every user with something new, returns the number of emails'''
+    chunk_size = chunk_size or current_app.config['DIGEST_CHUNK_SIZE']
+    since = datetime.utcnow() - timedelta(days=days)
+    text_template = current_app.jinja_env.get_template('email/digest.txt')
+    html_template = current_app.jinja_env.get_template('email/digest.html')
+    sender = current_app.config['ADMINS'][0]
+    sent = 0
+    with current_app.test_request_context(base_url=current_app.config['DIGEST_BASE_URL']):
+        home_url = url_for('main.index', _external=True)
+        for chunk in user_chunks(read_checkpoint(checkpoint), chunk_size):
+            missed = missed_posts([user.id for user in chunk], since, per_user)
+            for user in chunk:
+                if user.id not in missed:
+                    continue
+                total, posts = missed[user.id]
+                context = dict(user=user, total=total, posts=posts, home_url=home_url)
+                send_email('[Microblog] What you missed', sender=sender,
+                           recipients=[user.email],
+                           text_body=text_template.render(**context),
+                           html_body=html_template.render(**context))
+                sent += 1
+            db.session.rollback() # end the read transaction between chunks
+            mail_queue.wait() # only move the checkpoint past what was delivered
+            write_checkpoint(checkpoint, chunk[-1].id)
+            if log:
+                log('queued {} digests, up to user id {}'.format(sent, chunk[-1].id))
+    mail_queue.drain()
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint) # finished, the next run starts from the beginning
+    return sent
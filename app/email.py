@@ -1,7 +1,12 @@
+import atexit
+import os
+import queue
+import smtplib
+import threading
+from time import monotonic, sleep
 from flask_mail import Message
-from app import mail, app
-from flask import render_template
-from threading import Thread
+from flask import current_app
+from app import mail
 
 
 '''
@@ -15,32 +20,199 @@ go into a lot of detail on this, but know that there are two types of contexts,
 context and the request context. In most cases, these contexts are automatically managed by the 
 framework, but when the application starts custom threads, contexts for those threads may need 
 to be manually created.
+
+A thread per message does not hold up under a burst of emails though (and each mail.send()
+opens its own SMTP connection), so messages now go into a bounded queue that is serviced by a
+fixed pool of MAIL_WORKERS threads. Each worker keeps one SMTP connection open (mail.connect())
+and sends whatever is queued in batches of up to MAIL_BATCH_SIZE. A failed batch is retried
+on a new connection with exponential backoff, up to MAIL_RETRIES times. A message that can
+never be sent (refused, or broken itself) is counted as failed and skipped, and a worker
+that died anyway is replaced on the next send. drain() sends what is
+left and stops the workers; it runs at exit. The workers run in an application context of
+the application that started them, there is no global application anymore.
 '''
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+_STOP = object()
+
+
+class MailQueue(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.workers = []
+        self.pid = None
+        self.app = None # the application the workers run for, set by start()
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency_total = 0.0 # seconds between send_email() and the SMTP server accepting it
+        self.latency_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.workers and self.pid == os.getpid(): # a forked process needs its own workers
+                alive = [worker for worker in self.workers if worker.is_alive()]
+                if len(alive) == len(self.workers):
+                    return
+                # a worker died, replace it and keep what is queued
+                self.workers = alive
+            else:
+                self.app = current_app._get_current_object()
+                self.queue = queue.Queue(self.app.config['MAIL_QUEUE_SIZE'])
+                self.workers = []
+                self.pid = os.getpid()
+            while len(self.workers) < self.app.config['MAIL_WORKERS']:
+                worker = threading.Thread(target=self.run,
+                                          name='mail-worker-{}'.format(len(self.workers)))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def put(self, msg):
+        self.start()
+        try:
+            # blocks while the queue is full, so a burst slows the senders down
+            self.queue.put((msg, monotonic()), timeout=self.app.config['MAIL_QUEUE_TIMEOUT'])
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            self.app.logger.error('Mail queue is full, dropped email to %s', msg.recipients)
+            return False
+        with self.lock:
+            self.enqueued += 1
+        return True
+
+    def depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def stats(self):
+        return {'depth': self.depth(), 'enqueued': self.enqueued, 'sent': self.sent,
+                'retried': self.retried, 'failed': self.failed, 'dropped': self.dropped,
+                'latency_avg': self.latency_total / self.sent if self.sent else 0.0,
+                'latency_max': self.latency_max}
+
+    def next_batch(self, timeout):
+        '''
+        Waits for one message and then takes whatever else is already queued, up to
+        MAIL_BATCH_SIZE. Returns (batch, stop).
+        '''
+        item = self.queue.get(timeout=timeout)
+        if item is _STOP:
+            self.queue.task_done()
+            return [], True
+        batch = [item]
+        while len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.queue.task_done()
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def done(self, count=1):
+        '''count messages were sent or given up on, see wait()'''
+        for i in range(count):
+            self.queue.task_done()
+
+    def wait(self):
+        '''blocks until every message queued so far was sent or given up on'''
+        if self.queue is not None:
+            self.queue.join()
+
+    def run(self):
+        with self.app.app_context():
+            conn = None
+            stop = False
+            while not stop:
+                try:
+                    batch, stop = self.next_batch(self.app.config['MAIL_IDLE_TIMEOUT'])
+                except queue.Empty:
+                    conn = self.close(conn) # do not hold an idle connection open
+                    continue
+                conn = self.deliver(conn, batch)
+            self.close(conn)
+
+    def deliver(self, conn, batch):
+        attempt = 0
+        while batch:
+            try:
+                if conn is None:
+                    conn = mail.connect().__enter__()
+                while batch:
+                    msg, enqueued = batch[0]
+                    try:
+                        conn.send(msg)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused):
+                        # the server will never take this one, retrying would not help
+                        self.app.logger.exception('Email to %s was refused', msg.recipients)
+                        batch.pop(0)
+                        self.done()
+                        with self.lock:
+                            self.failed += 1
+                        continue
+                    except (smtplib.SMTPException, OSError):
+                        raise # the connection, retried below
+                    except Exception:
+                        # the message itself is broken (a bad header, no sender or
+                        # recipients, an encoding error), the worker has to survive it
+                        self.app.logger.exception('Could not send email to %s', msg.recipients)
+                        batch.pop(0)
+                        self.done()
+                        with self.lock:
+                            self.failed += 1
+                        continue
+                    batch.pop(0)
+                    self.done()
+                    latency = monotonic() - enqueued
+                    with self.lock:
+                        self.sent += 1
+                        self.latency_total += latency
+                        self.latency_max = max(self.latency_max, latency)
+            except (smtplib.SMTPException, OSError):
+                conn = self.close(conn)
+                if attempt >= self.app.config['MAIL_RETRIES']:
+                    self.app.logger.exception('Could not send %d emails', len(batch))
+                    with self.lock:
+                        self.failed += len(batch)
+                    self.done(len(batch))
+                    return None
+                with self.lock:
+                    self.retried += 1
+                sleep(self.app.config['MAIL_RETRY_BACKOFF'] * 2 ** attempt)
+                attempt += 1
+        return conn
+
+    def close(self, conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+    def drain(self, timeout=None):
+        '''sends everything that is queued and stops the workers'''
+        with self.lock:
+            workers, self.workers = self.workers, []
+            if not workers or self.pid != os.getpid():
+                return
+            workers = [worker for worker in workers if worker.is_alive()]
+        for worker in workers:
+            self.queue.put(_STOP) # behind the messages already queued
+        for worker in workers:
+            worker.join(timeout)
+
+
+mail_queue = MailQueue()
+atexit.register(mail_queue.drain)
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start() # starts the background thread by calling the above function
-
-def send_password_reset_email(user):
-	'''
-	The interesting part in this function is that the text and HTML content for the emails 
-	is generated from templates using the familiar render_template() function. The templates
-	receive the user and the token as arguments, so that a personalized email message can be 
-	generated.
-	'''
-	token = user.get_reset_password_token()
-	send_email('[Microblog] Reset Your Password',
-			sender=app.config['ADMINS'][0],
-			recipients=[user.email],
-			text_body=render_template('email/reset_password.txt',
-			user=user, token=token),
-			html_body=render_template('email/reset_password.html',
-			user=user, token=token))
-
-
+    mail_queue.put(msg) # one of the mail workers will send it
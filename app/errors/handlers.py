@@ -0,0 +1,14 @@
+from flask import render_template
+from app import db
+from app.errors import bp
+
+# the @bp.app_errorhandler is what directs this code to execute, for every route of the
+# application and not only the ones of this blueprint
+@bp.app_errorhandler(404)
+def not_found_error(error):
+    return render_template('404.html'), 404
+
+@bp.app_errorhandler(500)
+def internal_error(error):
+    db.session.rollback()
+    return render_template('500.html'), 500
@@ -0,0 +1,143 @@
+import heapq
+from itertools import islice
+from flask import abort, current_app
+from app import db
+from app.models import User, Post, followers, timeline
+from app.pagination import KeysetPage, decode_post_cursor, keyset_filter
+
+'''
+Hybrid home feed.
+
+Regular authors are pushed: User.publish() copies each new post into the timeline table of
+every follower. Celebrity authors (see User.is_celebrity()) would make that fan-out far too
+expensive, so their posts are only written once and pulled at read time instead. When an
+author drops back below the threshold, unfollow() pushes all of their posts to their
+followers (User.push_to_followers()), since from then on they are not pulled anymore.
+
+HybridFeed joins the two sources with a lazy k-way merge. Every source is an iterator that
+reads its query in small chunks ordered by (timestamp, id), and heapq.merge() only pulls from
+the source whose head is the newest, so building one page only reads about one page worth of
+rows from each source. With a cursor (see app/pagination.py) every source seeks straight to
+the cursor key, so deep pages cost the same as the first one.
+
+PullFeed is the same merge with every author pulled, see User.followed_posts().
+'''
+
+
+def _chunked(query, timestamp_col, id_col, chunk_size, key=None, older=True):
+    '''
+    Iterates over the query in (timestamp, id) order, newest first when older is True,
+    starting after key. Each chunk continues where the previous one stopped (keyset), so
+    rows are only loaded when the merge needs them.
+    '''
+    if older:
+        query = query.order_by(timestamp_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(timestamp_col.asc(), id_col.asc())
+    while True:
+        q = query
+        if key is not None:
+            q = q.filter(keyset_filter(timestamp_col, id_col, key, older))
+        rows = q.limit(chunk_size).all()
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        key = (rows[-1].timestamp, rows[-1].id)
+
+
+class FeedPage(object):
+    '''
+    Mimics the parts of Flask-SQLAlchemy's Pagination object used by the views, without
+    the COUNT(*) query (has_next is known from reading one extra post).
+    '''
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.next_num = page + 1 if has_next else None
+        self.prev_num = page - 1 if self.has_prev else None
+
+
+class HybridFeed(object):
+    def __init__(self, user, threshold=None):
+        self.user = user
+        self.threshold = threshold or current_app.config['FEED_CELEBRITY_THRESHOLD']
+
+    def celebrity_ids(self):
+        '''ids of the users I follow whose posts are not fanned out to me'''
+        celebrities = db.session.query(User.id).filter(
+            User.id.in_(db.select([followers.c.followed_id]).where(
+                followers.c.follower_id == self.user.id)),
+            User.followers_count >= self.threshold)
+        return [row[0] for row in celebrities]
+
+    def sources(self, chunk_size, key=None, older=True):
+        pushed = Post.query.join(timeline, timeline.c.post_id == Post.id).filter(
+            timeline.c.user_id == self.user.id)
+        yield _chunked(pushed, timeline.c.timestamp, timeline.c.post_id, chunk_size,
+                       key, older)
+        for author_id in self.celebrity_ids():
+            pulled = Post.query.filter(Post.user_id == author_id)
+            yield _chunked(pulled, Post.timestamp, Post.id, chunk_size, key, older)
+
+    def __iter__(self):
+        return self.iter_posts()
+
+    def iter_posts(self, chunk_size=None, key=None, older=True):
+        '''
+        Newest first (oldest first if older is False), starting after key. A post can show
+        up in both sources if its author crossed the celebrity threshold, so consecutive
+        duplicates are dropped.
+        '''
+        chunk_size = chunk_size or current_app.config['POSTS_PER_PAGE'] + 1
+        merged = heapq.merge(*self.sources(chunk_size, key, older),
+                             key=lambda post: (post.timestamp, post.id), reverse=older)
+        last_id = None
+        for post in merged:
+            if post.id != last_id:
+                yield post
+            last_id = post.id
+
+    def newest(self):
+        '''the newest post of the feed, or None. Reads one row from each source.'''
+        return next(self.iter_posts(chunk_size=1), None)
+
+    def paginate(self, page=1, per_page=None, error_out=True):
+        '''same call signature as Flask-SQLAlchemy's Query.paginate()'''
+        per_page = per_page or current_app.config['POSTS_PER_PAGE']
+        if page < 1:
+            if error_out:
+                abort(404)
+            page = 1
+        start = (page - 1) * per_page
+        items = list(islice(self.iter_posts(per_page + 1), start, start + per_page + 1))
+        if not items and page != 1 and error_out:
+            abort(404)
+        return FeedPage(items[:per_page], page, per_page, len(items) > per_page)
+
+    def keyset_paginate(self, cursor, per_page=None):
+        '''same as keyset_paginate() in app/pagination.py, over the merged feed'''
+        per_page = per_page or current_app.config['POSTS_PER_PAGE']
+        direction, key = decode_post_cursor(cursor) if cursor else ('f', None)
+        rows = list(islice(self.iter_posts(per_page + 1, key, direction != 'p'),
+                           per_page + 1))
+        return KeysetPage.from_rows(rows, direction, per_page)
+
+
+class PullFeed(HybridFeed):
+    '''The feed without the timeline table: my posts and those of everyone I follow are pulled.'''
+    def __init__(self, user):
+        self.user = user
+
+    def author_ids(self):
+        followed = db.session.query(followers.c.followed_id).filter(
+            followers.c.follower_id == self.user.id)
+        return [self.user.id] + [row[0] for row in followed]
+
+    def sources(self, chunk_size, key=None, older=True):
+        for author_id in self.author_ids():
+            pulled = Post.query.filter(Post.user_id == author_id)
+            yield _chunked(pulled, Post.timestamp, Post.id, chunk_size, key, older)
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from flask import Blueprint, current_app, render_template
+from jinja2 import Markup
+
+'''
+Fragment cache for rendered posts.
+
+A feed page renders _post.html once per post: two url_for() calls, the avatar URL and the
+moment.js markup. None of that depends on who is looking at the page, only on the post and
+on its author's username and avatar, so the rendered HTML is kept in a size bounded LRU
+keyed on (post id, author id, author profile_version). User.profile_version goes up when
+the username or email changes (edit_profile()), so a profile change makes the old fragments
+unreachable and they age out of the LRU.
+
+Templates call {{ post_fragment(post) }} instead of {% include '_post.html' %}.
+FRAGMENT_CACHE_SIZE = 0 turns the cache off.
+'''
+
+
+class FragmentCache(object):
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        maxsize = self.maxsize
+        if maxsize is None:
+            maxsize = current_app.config['FRAGMENT_CACHE_SIZE']
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = render()
+        if maxsize > 0:
+            with self.lock:
+                self.entries[key] = html
+                while len(self.entries) > maxsize:
+                    self.entries.popitem(last=False)
+        return html
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+bp = Blueprint('fragments', __name__)
+
+
+@bp.app_template_global()
+def post_fragment(post):
+    key = ('post', post.id, post.user_id, post.author.profile_version)
+    return fragment_cache.get_or_render(
+        key, lambda: Markup(render_template('_post.html', post=post)))
@@ -0,0 +1,78 @@
+import atexit
+import threading
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from flask import current_app
+from app import db
+from app.models import User
+
+'''
+Write-behind buffer for User.last_seen.
+
+before_request() used to update last_seen and commit on every authenticated request, which
+turned every page view into a write transaction (and those serialize on SQLite). Now the
+request only records the time in a dict keyed by user id, which keeps just the latest value
+for each user. A background thread writes the whole dict every LAST_SEEN_FLUSH_INTERVAL
+seconds with a single executemany UPDATE, so a user causes at most one write per interval.
+Whatever is still buffered is written when the process exits. The buffer keeps the
+application of the last request that touched it, the thread has no context of its own.
+'''
+
+
+class LastSeenBuffer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {} # user id -> latest last_seen
+        self.thread = None
+        self.app = None
+        self.stopping = threading.Event()
+
+    def touch(self, user_id, when=None):
+        with self.lock:
+            self.pending[user_id] = when or datetime.utcnow()
+            self.app = current_app._get_current_object()
+        if self.thread is None or not self.thread.is_alive(): # also restarts after a fork
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='last-seen-flusher')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.app.config['LAST_SEEN_FLUSH_INTERVAL']):
+            self.flush()
+
+    def flush(self):
+        '''writes everything buffered so far, returns the number of users updated'''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        user = User.__table__
+        try:
+            with db.get_engine(self.app).begin() as conn:
+                conn.execute(user.update().where(user.c.id == db.bindparam('_id')).values(
+                    last_seen=db.bindparam('_last_seen')),
+                    [{'_id': id, '_last_seen': when} for id, when in pending.items()])
+        except SQLAlchemyError:
+            self.app.logger.exception('Could not write last_seen for %d users', len(pending))
+            with self.lock: # try again on the next flush, unless there is a newer value
+                for id, when in pending.items():
+                    self.pending.setdefault(id, when)
+            return 0
+        return len(pending)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+
+
+last_seen_buffer = LastSeenBuffer()
+atexit.register(last_seen_buffer.stop)
@@ -0,0 +1,51 @@
+from flask import request
+from flask_wtf import FlaskForm
+from wtforms import StringField, SubmitField, TextAreaField
+from wtforms.validators import ValidationError, DataRequired, Length
+from app.models import User
+
+
+class EditProfileForm(FlaskForm):
+    '''
+    The implementation is in a custom validation method, but there is an overloaded 
+    constructor that accepts the original username as an argument. This username is 
+    saved as an instance variable, and checked in the validate_username() method. If 
+    the username entered in the form is the same as the original username, then there 
+    is no reason to check the database for duplicates.
+
+    To use this new validation method, I need to add the original username argument 
+    in the view function, where the form object is created:
+    '''
+    username = StringField('Username', validators=[DataRequired()])
+    about_me = TextAreaField('About me', validators=[Length(min=0, max=140)])
+    submit = SubmitField('Submit')
+
+    def __init__(self, original_username, *args, **kwargs):
+        super(EditProfileForm, self).__init__(*args, **kwargs)
+        self.original_username = original_username
+
+    def validate_username(self, username):
+        if username.data != self.original_username:
+            user = User.query.filter_by(username=self.username.data).first()
+            if user is not None:
+                raise ValidationError('Please use a different username.')
+
+
+class PostForm(FlaskForm):
+    post = TextAreaField('Say something', validators=[DataRequired(), Length(min=1,max=140)])
+    submit = SubmitField('Submit')
+
+
+class SearchForm(FlaskForm):
+    '''
+    Submitted with GET (so results can be bookmarked), which means the data comes from the
+    query string and there is no CSRF token to check.
+    '''
+    q = StringField('Search', validators=[DataRequired()])
+
+    def __init__(self, *args, **kwargs):
+        if 'formdata' not in kwargs:
+            kwargs['formdata'] = request.args
+        if 'meta' not in kwargs:
+            kwargs['meta'] = {'csrf': False}
+        super(SearchForm, self).__init__(*args, **kwargs)
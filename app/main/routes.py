@@ -0,0 +1,247 @@
+from datetime import datetime
+from flask import render_template, flash, redirect, url_for, request, g, current_app
+from flask_login import current_user, login_required
+from app import db
+from app.main import bp
+from app.main.forms import EditProfileForm, PostForm, SearchForm
+from app.models import User, Post, user_cache
+from app.conditional import conditional_get
+from app.feed import HybridFeed
+from app.last_seen import last_seen_buffer
+from app.pagination import keyset_paginate, pagination_urls
+from app.recent import recent_posts
+from app.trending import trending_tags
+
+'''
+These routes are know as the view function
+Note the 'Post/Redirect/Get' pattern (even redirect to the same page). This avoids inserting 
+duplicate posts when a user refreshes the page after submitting a web form.
+
+The render_template() function invokes the Jinja2 template engine that comes bundled 
+with the Flask framework. Jinja2 substitutes {{ ... }} blocks in the template with the 
+corresponding values, given by the arguments provided in the render_template() call.
+'''
+
+@bp.before_app_request
+def before_request():
+    '''
+    The @before_app_request decorator of the blueprint registers the decorated function to be executed right 
+    before the view function. This is extremely useful because now I can insert code that I want 
+    to execute before any view function in the application, and I can have it in a single place. 
+    The implementation simply checks if the current_user is logged in, and in that case records the 
+    current time as its last_seen. The write to the database happens later, in batches (see
+    app/last_seen.py), so a page view does not need a write transaction.
+    '''
+    if current_user.is_authenticated:
+        last_seen_buffer.touch(current_user.id, datetime.utcnow())
+        g.search_form = SearchForm() # rendered in the navigation bar of every page
+
+
+# SCAFOLDING EXAMPLE SCRIPT
+# @app.route('/')
+# @app.route('/index') # default method only includes 'GET'
+# @login_required
+# def index():
+#     posts = [
+#         {'author': {'username': 'Miguel'},'body': 'Some beautiful text'},
+#         {'author': {'username': 'Susan B'}, 'body': 'Susan B Anthony is the GREATEST!'}
+#     ]
+
+#     return render_template('index.html', title='Home', posts=posts)
+
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
+@login_required
+def index():
+    '''
+    first, import Post and PostForm classes. Next, accepts POSTS in both routes associated with the index view
+    function (in addt to GET reqs). This view function will now accept form data. Then form processing logic 
+    inserts a new post record into the database. Finally, send the form to render the template.
+    '''
+    form = PostForm()
+    if form.validate_on_submit():
+        post = current_user.publish(form.post.data) # creates the post and fans it out to followers
+        db.session.commit()
+        user_cache.invalidate(current_user.id) # posts_count changed
+        trending_tags.add_post(post)
+        recent_posts.append(post)
+        flash('Your post is now live!')
+        return redirect(url_for('main.index'))
+        # So, why the redirect here? It is a standard practice to respond to a POST request generated by a web form 
+        # submission with a redirect. Refreshes the browser. This simple trick is called the Post/Redirect/Get pattern. 
+        
+    # posts = current_user.followed_posts().all() # get all posts prior to pagination
+    feed = HybridFeed(current_user)
+    newest = feed.newest() # answer with 304 Not Modified if the feed did not change
+    not_modified = conditional_get(
+        [current_user.id, current_user.profile_version, current_user.follow_version,
+         newest and newest.id], newest and newest.timestamp)
+    if not_modified:
+        return not_modified
+    page = request.args.get('page', type=int)
+    if page is not None: # old ?page= links keep working
+        posts = feed.paginate(page, current_app.config['POSTS_PER_PAGE'], False)
+    else:
+        posts = feed.keyset_paginate(request.args.get('cursor'),
+                                     current_app.config['POSTS_PER_PAGE'])
+    Post.preload_authors(posts.items) # one query for all the authors on the page
+    next_url, prev_url = pagination_urls('main.index', posts)
+    return render_template('index.html', title='Home', form=form,
+                           posts=posts.items, next_url=next_url,
+                           prev_url=prev_url)
+    # SCAFFOLDING
+    # posts = [
+    #     {'author': {'username': 'Miguel'},'body': 'Some beautiful text'},
+    #     {'author': {'username': 'Susan B'}, 'body': 'Susan B Anthony is the GREATEST!'}
+    # ]
+
+
+    return render_template("index.html", title='Home Page', form=form,
+                           posts=posts)
+
+
+
+'''
+When a route has a dynamic component (e.g. <>), Flask will accept any text in that portion 
+of the URL, and will invoke the view function with the actual text as an argument. For 
+example, if the client browser requests URL /user/susan, the view function is going to be 
+called with the argument username set to 'susan'. 
+'''
+@bp.route('/user/<username>')
+@login_required
+def user(username):
+    # SCAFOLDING
+    # user = User.query.filter_by(username=username).first_or_404() # sends a 404 if no match
+    # # other query options include .first() and .all()
+    # # returns user object with attributes of field names in the database
+    # posts = [
+    #     {'author': user, 'body': 'Test post #1'},
+    #     {'author': user, 'body': 'Test post #2'}
+    # ]
+    # # posts = User.query.
+    # return render_template('user.html', user=user, posts=posts)
+
+    user = User.query.filter_by(username=username).first_or_404()
+    newest = user.posts.order_by(Post.timestamp.desc(), Post.id.desc()).first()
+    not_modified = conditional_get(
+        [current_user.id, current_user.profile_version, current_user.follow_version,
+         user.id, user.profile_version, user.about_me, user.last_seen, user.followers_count,
+         user.followed_count, user.posts_count, newest and newest.id],
+        newest and newest.timestamp)
+    if not_modified:
+        return not_modified
+    page = request.args.get('page', type=int)
+    if page is not None: # old ?page= links keep working
+        posts = user.posts.order_by(Post.timestamp.desc()).paginate(
+            page, current_app.config['POSTS_PER_PAGE'], False)
+    else:
+        posts = keyset_paginate(user.posts, Post.timestamp, Post.id,
+                                request.args.get('cursor'), current_app.config['POSTS_PER_PAGE'])
+    Post.preload_authors(posts.items)
+    next_url, prev_url = pagination_urls('main.user', posts, username=user.username)
+    return render_template('user.html', user=user, posts=posts.items,
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    form = EditProfileForm(current_user.username) # allows error caused by selecting same username
+    # as someone else to be resolved without interference if you enter your current username
+    if form.validate_on_submit(): # only returns true if a POST method AND information is validated
+        current_user.username = form.username.data
+        current_user.about_me = form.about_me.data
+        db.session.commit()
+        user_cache.invalidate(current_user.id) # the cached copy of the user is out of date
+        flash('Your changes have been saved.') # sends text to the flash section of the base template
+        return redirect(url_for('main.edit_profile'))
+    elif request.method == 'GET': # if the client is GET info (i.e. first directed to the URL)
+        form.username.data = current_user.username # fill in the fields with previously entered data
+        form.about_me.data = current_user.about_me # from the database
+    return render_template('edit_profile.html', title='Edit Profile',
+                           form=form)
+
+
+@bp.route('/explore')
+@login_required
+def explore():
+    '''
+    Notice the index.html template is reused from '/index' however, there is no form and the posts are not filtered
+    '''
+    # SCAFFOLDING
+    # posts = Post.query.order_by(Post.timestamp.desc()).all()
+
+    newest = Post.query.order_by(Post.id.desc()).first()
+    not_modified = conditional_get([current_user.id, current_user.profile_version,
+                                    newest and newest.id], newest and newest.timestamp)
+    if not_modified:
+        return not_modified
+    page = request.args.get('page', type=int)
+    if page is not None: # old ?page= links keep working
+        posts = Post.query.order_by(Post.timestamp.desc()).paginate(
+            page, current_app.config['POSTS_PER_PAGE'], False)
+        Post.preload_authors(posts.items)
+    else:
+        # the newest pages come from the in-memory buffer (app/recent.py), deeper ones
+        # from the database
+        recent_posts.sync(newest and newest.id)
+        posts = recent_posts.page(request.args.get('cursor'), current_app.config['POSTS_PER_PAGE'])
+        if posts is None:
+            posts = keyset_paginate(Post.query, Post.timestamp, Post.id,
+                                    request.args.get('cursor'), current_app.config['POSTS_PER_PAGE'])
+            Post.preload_authors(posts.items)
+    next_url, prev_url = pagination_urls('main.explore', posts)
+    return render_template("index.html", title='Explore', posts=posts.items,
+                          next_url=next_url, prev_url=prev_url,
+                          trending=trending_tags.top(10))
+
+
+
+@bp.route('/search')
+@login_required
+def search():
+    '''
+    Full-text search of the posts, best matches first. Reuses the index.html template like
+    explore does.
+    '''
+    if not g.search_form.validate():
+        return redirect(url_for('main.explore'))
+    q = g.search_form.q.data
+    posts = Post.search(q, request.args.get('cursor'), current_app.config['POSTS_PER_PAGE'])
+    Post.preload_authors(posts.items)
+    next_url, prev_url = pagination_urls('main.search', posts, q=q)
+    return render_template('index.html', title='Search', posts=posts.items,
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/follow/<username>')
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash('User {} not found.'.format(username))
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash('You cannot follow yourself!')
+        return redirect(url_for('main.user', username=username))
+    current_user.follow(user)
+    db.session.commit()
+    user_cache.invalidate(current_user.id, user.id) # both counters changed
+    flash('You are following {}!'.format(username))
+    return redirect(url_for('main.user', username=username))
+
+@bp.route('/unfollow/<username>')
+@login_required
+def unfollow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash('User {} not found.'.format(username))
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash('You cannot unfollow yourself!')
+        return redirect(url_for('main.user', username=username))
+    current_user.unfollow(user)
+    db.session.commit()
+    user_cache.invalidate(current_user.id, user.id)
+    flash('You are not following {}.'.format(username))
+    return redirect(url_for('main.user', username=username))
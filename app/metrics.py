@@ -0,0 +1,187 @@
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+from flask import Blueprint, Response, abort, current_app, g, request
+from app import db
+from app.email import mail_queue
+from app.fragments import fragment_cache
+from app.models import gravatar_url, user_cache
+
+'''
+/metrics in the Prometheus text format.
+
+Every request is counted per endpoint, method and status code, and its duration goes into a
+histogram per endpoint with the fixed buckets of METRICS_BUCKETS. Recording happens on
+every request, so it has to be cheap: each thread writes to its own shard (a couple of
+dicts of plain lists) that no other thread writes to, which needs no lock at all, and a
+scrape adds the shards up. The lock is only taken when a thread makes its shard, and by
+the scrape. When a thread ends its shard is added to a retired total and dropped, so there
+are only as many shards as live threads, even under a server that starts a thread per
+request. Recording costs a couple of microseconds (python -m benchmarks.metrics).
+
+The scrape also reports what the rest of the app counts already: the mail queue, the
+database connection pool and the hit ratios of the in-process caches.
+When METRICS_TOKEN is set the scraper has to send it as "Authorization: Bearer <token>".
+'''
+
+
+class _ShardOwner(object):
+    '''kept in the thread local next to the shard, it is freed when its thread ends'''
+
+
+class RequestMetrics(object):
+    def __init__(self, buckets=()):
+        self.buckets = tuple(buckets) # upper bounds in seconds, +Inf is implied
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = [] # one per live thread
+        self.retired = ({}, {}) # what the threads that ended had recorded
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = ({}, {}) # (counts, histograms)
+            owner = _ShardOwner()
+            with self.lock:
+                self.shards.append(shard)
+            # a thread per request server would otherwise leave a shard behind per request
+            weakref.finalize(owner, self.retire, shard)
+            self.local.owner = owner
+            self.local.shard = shard
+            return shard
+
+    def retire(self, shard):
+        '''folds the shard of a thread that ended into the retired totals'''
+        with self.lock:
+            self.shards = [live for live in self.shards if live is not shard]
+            self.merge(self.retired, shard)
+
+    def merge(self, into, shard):
+        counts, histograms = into
+        for key, count in list(shard[0].items()):
+            counts[key] = counts.get(key, 0) + count
+        for endpoint, histogram in list(shard[1].items()):
+            total = histograms.setdefault(endpoint, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(list(histogram)):
+                total[i] += value
+
+    def observe(self, endpoint, method, status, seconds):
+        counts, histograms = self.shard()
+        key = (endpoint, method, status)
+        counts[key] = counts.get(key, 0) + 1
+        histogram = histograms.get(endpoint)
+        if histogram is None:
+            # one counter per bucket plus +Inf, then the sum of the observations
+            histogram = histograms[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def collect(self):
+        '''({(endpoint, method, status): count}, {endpoint: [bucket counts..., sum]})'''
+        totals = ({}, {})
+        with self.lock:
+            shards = list(self.shards)
+            self.merge(totals, self.retired)
+        for shard in shards:
+            self.merge(totals, shard)
+        return totals
+
+    def clear(self):
+        with self.lock:
+            for counts, histograms in self.shards + [self.retired]:
+                counts.clear()
+                histograms.clear()
+
+
+request_metrics = RequestMetrics()
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.record_once
+def configure_buckets(state):
+    # the buckets come from the configuration of the application, known once it registers us
+    request_metrics.buckets = tuple(state.app.config['METRICS_BUCKETS'])
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.metrics_start = perf_counter()
+
+
+@bp.after_app_request
+def record_request(response):
+    start = g.get('metrics_start')
+    if start is not None:
+        request_metrics.observe(request.endpoint or 'unknown', request.method,
+                                response.status_code, perf_counter() - start)
+    return response
+
+
+def labels(**values):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                          for name, value in sorted(values.items())) + '}'
+
+
+def process_metrics():
+    '''(name, type, help, value) of the numbers the rest of the app keeps in this process'''
+    values = []
+    mail = mail_queue.stats()
+    values.append(('microblog_mail_queue_depth', 'gauge', 'Emails waiting to be sent.',
+                   mail['depth']))
+    for name in ('enqueued', 'sent', 'retried', 'failed', 'dropped'):
+        values.append(('microblog_mail_{}_total'.format(name), 'counter',
+                       'Emails {} since the process started.'.format(name), mail[name]))
+    pool = db.engine.pool
+    if hasattr(pool, 'checkedout'): # QueuePool, not the SQLite pools
+        values.append(('microblog_db_pool_checked_out', 'gauge', 'Connections in use.',
+                       pool.checkedout()))
+        values.append(('microblog_db_pool_size', 'gauge', 'Size of the connection pool.',
+                       pool.size()))
+    for name, hits, misses in (
+            ('user_cache', user_cache.hits, user_cache.misses),
+            ('fragment_cache', fragment_cache.hits, fragment_cache.misses),
+            ('avatar_url_cache',) + tuple(gravatar_url.cache_info()[:2])):
+        total = hits + misses
+        values.append(('microblog_{}_hit_ratio'.format(name), 'gauge',
+                       'Share of {} lookups that were hits.'.format(name.replace('_', ' ')),
+                       hits / total if total else 0.0))
+    return values
+
+
+def render_metrics():
+    lines = []
+    counts, histograms = request_metrics.collect()
+    lines.append('# HELP microblog_requests_total Requests handled, by endpoint and status.')
+    lines.append('# TYPE microblog_requests_total counter')
+    for (endpoint, method, status), count in sorted(counts.items()):
+        lines.append('microblog_requests_total{} {}'.format(
+            labels(endpoint=endpoint, method=method, status=status), count))
+    lines.append('# HELP microblog_request_duration_seconds Time spent handling requests.')
+    lines.append('# TYPE microblog_request_duration_seconds histogram')
+    bounds = ['{:g}'.format(bound) for bound in request_metrics.buckets] + ['+Inf']
+    for endpoint, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(bounds, histogram):
+            cumulative += count
+            lines.append('microblog_request_duration_seconds_bucket{} {}'.format(
+                labels(endpoint=endpoint, le=bound), cumulative))
+        lines.append('microblog_request_duration_seconds_sum{} {}'.format(
+            labels(endpoint=endpoint), histogram[-1]))
+        lines.append('microblog_request_duration_seconds_count{} {}'.format(
+            labels(endpoint=endpoint), cumulative))
+    for name, type, help, value in process_metrics():
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, type))
+        lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+@bp.route('/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
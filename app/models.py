@@ -1,15 +1,35 @@
+import re
 from datetime import datetime
+from functools import lru_cache
 from hashlib import md5 # for the avitar
 from time import time
 import jwt
-from app import db, login, app
+from app import db, login
+from flask import abort, current_app, g, has_request_context
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
+from app.pagination import KeysetPage, decode_cursor
+from app.passwords import password_hasher
+from app.user_cache import UserCache
+
+
+def email_digest(email):
+    # gets a hash code for user's email address
+    return md5(email.lower().encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=4096) # per-process memo, most calls ask for the 70 and 128 pixel sizes
+def gravatar_url(digest, size):
+    return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
+        digest, size) # from gravatar, sends in hash code, (?-new arg) d argument for returning images
+        # from unregistered users (identicon = geometric shapes), (&-new arg) s for size in pixels 
+        # default (80 x 80)
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return user_cache.load(int(id)) # no query when the user is cached, see app/user_cache.py
 
 # see section on followers below
 # Note that I am not declaring this table as a model, like I did for the users and 
@@ -17,16 +37,43 @@ def load_user(id):
 # keys, I created it without an associated model class.
 followers = db.Table('followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id')))
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id')),
+    # one row per pair; the unique index also serves "who do I follow" lookups
+    db.Index('uq_followers_follower_id_followed_id', 'follower_id', 'followed_id', unique=True),
+    # and this one serves "who follows me" (fan-out on write, follower counts)
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id'))
+
+# Materialized home timeline (fan-out on write). Every post is copied into a row per
+# reader (the author plus each of the author's followers) when it is published, so
+# reading a home feed is a single range scan on (user_id, timestamp) instead of a
+# join + union + sort over the whole follow graph.
+timeline = db.Table('timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
+    db.Column('timestamp', db.DateTime),
+    db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp', 'post_id'))
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
+    avatar_hash = db.Column(db.String(32), index=True) # md5 of the email, kept by set_email()
+    # bumped whenever something shown next to the user's posts changes (username, avatar), so
+    # anything cached from the old values can be told apart, see app/fragments.py
+    profile_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # bumped by follow() and unfollow(), so the home feed's validator (app/conditional.py) can
+    # tell that the set of followed users changed without loading it
+    follow_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     password_hash = db.Column(db.String(128))
     posts = db.relationship('Post', backref='author', lazy='dynamic') # relationship means author is an attribute from posts to users
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # counter cache, kept in step with the followers and post tables by follow(), unfollow()
+    # and publish() (and recomputed by "flask reconcile-counters") so profile pages do not
+    # need COUNT(*) queries
+    followers_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    posts_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
 
     # Many to Many self-referential relationship table
@@ -48,27 +95,188 @@ class User(UserMixin, db.Model):
         # method to add follower to user; user1.followed.append(user2)
         if not self.is_following(user): # prevents duplicate unfollow data records between the two users
             self.followed.append(user)
+            ids = self.followed_ids()
+            if ids is not None:
+                ids.add(user.id)
+            celebrity = user.is_celebrity()
+            self.adjust_counter('followed_count', 1)
+            self.adjust_counter('follow_version', 1)
+            user.adjust_counter('followers_count', 1)
+            if celebrity:
+                return # celebrity posts are pulled at read time, see app/feed.py
+            # backfill the newly followed user's posts into my timeline
+            db.session.execute(timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                db.select([db.literal(self.id), Post.id, Post.timestamp]).where(
+                    Post.user_id == user.id)))
 
     def unfollow(self, user):
         # user1.followed.remove(user2)
         if self.is_following(user): # prevents duplicate unfollow data records between the two users
             self.followed.remove(user)
+            ids = self.followed_ids()
+            if ids is not None:
+                ids.discard(user.id)
+            celebrity = user.is_celebrity()
+            self.adjust_counter('followed_count', -1)
+            self.adjust_counter('follow_version', 1)
+            user.adjust_counter('followers_count', -1)
+            # drop the unfollowed user's posts from my timeline
+            db.session.execute(timeline.delete().where(db.and_(
+                timeline.c.user_id == self.id,
+                timeline.c.post_id.in_(
+                    db.select([Post.id]).where(Post.user_id == user.id)))))
+            if celebrity and not user.is_celebrity():
+                user.push_to_followers() # no longer pulled, see app/feed.py
+
+    def push_to_followers(self):
+        '''
+        Copies all my posts into the timelines of all my followers, skipping the rows that
+        are already there. Used when I drop below the celebrity threshold: from then on my
+        followers' feeds only read my posts from their timelines, and the posts I wrote as a
+        celebrity (or that a follower skipped backfilling while following a celebrity) were
+        never pushed. It happens at most once per demotion, at about threshold followers.
+        '''
+        db.session.flush() # execute() does not autoflush, an unfollow may still be pending
+        pushed = timeline.alias()
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            db.select([followers.c.follower_id, Post.id, Post.timestamp]).select_from(
+                followers.join(Post, Post.user_id == followers.c.followed_id)).where(db.and_(
+                    followers.c.followed_id == self.id,
+                    ~db.exists().where(db.and_(
+                        pushed.c.user_id == followers.c.follower_id,
+                        pushed.c.post_id == Post.id))))))
 
     def is_following(self, user):
-        # The is_following() method issues a query on the followed relationship to check if a link between two users already exists. 
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        # The is_following() method checks if a link between two users already exists. Inside a
+        # request it looks at followed_ids(), so any number of checks costs a single query.
+        ids = self.followed_ids()
+        if ids is not None:
+            return user.id in ids
+        return db.session.query(db.exists().where(db.and_(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id))).scalar()
+
+    def followed_ids(self):
+        '''
+        The set of ids of the users I follow, loaded lazily once per request (and kept up to
+        date by follow() and unfollow()). Returns None outside of a request.
+        '''
+        if not has_request_context() or self.id is None:
+            return None
+        cache = g.setdefault('followed_ids', {})
+        if self.id not in cache:
+            cache[self.id] = {row[0] for row in db.session.query(
+                followers.c.followed_id).filter(followers.c.follower_id == self.id)}
+        return cache[self.id]
 
     def followed_posts(self):
         '''
-        What I'm saying with this call is that I want the database to create a temporary table that combines data from posts 
-        and followers tables. The data is going to be merged according to the condition that I passed as argument.
+        My posts and the posts of the users I follow, newest first, read straight from the
+        post table (no timeline). Returns a PullFeed (app/feed.py): one range scan of the
+        (user_id, timestamp) index per author, joined by a k-way merge, so nothing is ever
+        sorted and a page only reads about a page of rows per author. It costs one query
+        per author I follow, which is why the views use home_timeline() and HybridFeed, but
+        it is the reference the tests and benchmarks check the timeline against.
+        '''
+        from app.feed import PullFeed # app.feed imports this module
+        return PullFeed(self)
+
+    def home_timeline(self):
+        '''
+        Same posts as followed_posts(), but read from the materialized timeline table, so the
+        cost is one indexed range scan no matter how many users I follow.
+        '''
+        return Post.query.join(timeline, timeline.c.post_id == Post.id).filter(
+            timeline.c.user_id == self.id).order_by(
+                timeline.c.timestamp.desc(), timeline.c.post_id.desc())
+
+    def is_celebrity(self):
+        '''
+        Authors with a very large audience are not fanned out on write; their followers
+        pull their posts at read time instead (see HybridFeed in app/feed.py).
+        '''
+        return (self.followers_count or 0) >= current_app.config['FEED_CELEBRITY_THRESHOLD']
+
+    def publish(self, body):
+        '''
+        Creates a new post and pushes it into the timeline of the author and of every
+        follower (fan-out on write). Celebrity posts only go to the author's own timeline.
+        The caller is responsible for the commit.
+        '''
+        post = Post(body=body, author=self)
+        db.session.add(post)
+        db.session.flush() # assigns post.id and post.timestamp
+        readers = db.select([db.literal(self.id).label('follower_id')])
+        if not self.is_celebrity():
+            readers = db.select([followers.c.follower_id]).where(
+                followers.c.followed_id == self.id).union(readers)
+        readers = readers.alias()
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            db.select([readers.c.follower_id, db.literal(post.id),
+                       db.literal(post.timestamp, db.DateTime)])))
+        self.adjust_counter('posts_count', 1)
+        return post
+
+    def adjust_counter(self, name, delta):
         '''
-        followed = Post.query.join(
-            followers, (followers.c.followed_id == Post.user_id)).filter(
-                followers.c.follower_id == self.id)
-        own = Post.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(Post.timestamp.desc())
+        Increments one of the counter columns in the database (not in Python, so concurrent
+        updates are not lost) and expires the attribute so the next read sees the new value.
+        '''
+        column = getattr(User.__table__.c, name)
+        db.session.execute(User.__table__.update().where(
+            User.__table__.c.id == self.id).values({name: column + delta}))
+        db.session.expire(self, [name])
+
+    @staticmethod
+    def reconcile_counters(after_id, limit):
+        '''
+        Recomputes the counter columns of the next limit users with an id above after_id.
+        Returns the last id processed, or None when there are no users left.
+        '''
+        ids = [row[0] for row in db.session.query(User.id).filter(
+            User.id > after_id).order_by(User.id).limit(limit)]
+        if not ids:
+            return None
+        user = User.__table__
+        db.session.execute(user.update().where(user.c.id.in_(ids)).values(
+            followers_count=db.select([db.func.count()]).where(
+                followers.c.followed_id == user.c.id).as_scalar(),
+            followed_count=db.select([db.func.count()]).where(
+                followers.c.follower_id == user.c.id).as_scalar(),
+            posts_count=db.select([db.func.count(Post.id)]).where(
+                Post.user_id == user.c.id).as_scalar()))
+        return ids[-1]
+
+    @staticmethod
+    def rebuild_timelines(after_id, limit, since=None):
+        '''
+        Rebuilds the timeline rows of the next limit users with an id above after_id from
+        the posts and the follow graph, the same rows publish() and follow() would have made
+        (only for the posts newer than since, when given). The counters have to be right
+        first, they decide who is a celebrity.
+        Returns the last id processed, or None when there are no users left.
+        '''
+        ids = [row[0] for row in db.session.query(User.id).filter(
+            User.id > after_id).order_by(User.id).limit(limit)]
+        if not ids:
+            return None
+        author = User.__table__
+        db.session.execute(timeline.delete().where(timeline.c.user_id.in_(ids)))
+        columns = ['user_id', 'post_id', 'timestamp']
+        recent = Post.timestamp > since if since is not None else db.true()
+        db.session.execute(timeline.insert().from_select(columns, db.select(
+            [Post.user_id, Post.id, Post.timestamp]).where(db.and_(
+                Post.user_id.in_(ids), recent))))
+        db.session.execute(timeline.insert().from_select(columns, db.select(
+            [followers.c.follower_id, Post.id, Post.timestamp]).select_from(
+                followers.join(author, author.c.id == followers.c.followed_id).join(
+                    Post, Post.user_id == followers.c.followed_id)).where(db.and_(
+                followers.c.follower_id.in_(ids), recent,
+                author.c.followers_count < current_app.config['FEED_CELEBRITY_THRESHOLD']))))
+        return ids[-1]
 
     # EXPLANATION OF ABOVE
     # # there are three main sections designed by the join(), filter() and order_by() methods of the SQLAlchemy query object
@@ -93,10 +301,28 @@ class User(UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password) # runs on the hashing pool, see app/passwords.py
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def needs_rehash(self):
+        # True when the stored hash was made with a different cost than PASSWORD_HASH_METHOD
+        return password_hasher.needs_rehash(self.password_hash)
+
+    @validates('email')
+    def set_email(self, key, email):
+        # runs every time the email is assigned, so the stored digest never goes stale
+        if self.id is not None and email != self.email:
+            self.profile_version = (self.profile_version or 0) + 1
+        self.avatar_hash = email_digest(email) if email else None
+        return email
+
+    @validates('username')
+    def set_username(self, key, username):
+        if self.id is not None and username != self.username:
+            self.profile_version = (self.profile_version or 0) + 1
+        return username
 
     def avatar(self, size):
         '''
@@ -106,12 +332,10 @@ class User(UserMixin, db.Model):
         by the Gravatar service. Then, because the MD5 support in Python works on bytes and not on strings, 
         I encode the string as bytes before passing it on to the hash function.
         - this is called from the user template & _post sub template 
+        The hash is computed once when the email is set and stored in avatar_hash, so this is only a
+        (memoized) string format.
         '''
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest() # gets a hash code for user's email address
-        return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
-            digest, size) # from gravatar, sends in hash code, (?-new arg) d argument for returning images
-            # from unregistered users (identicon = geometric shapes), (&-new arg) s for size in pixels 
-            # default (80 x 80)
+        return gravatar_url(self.avatar_hash or email_digest(self.email), size)
 
     # Since these tokens belong to users, I'm going to write the token generation and verification functions 
     # as methods in the User model:
@@ -121,7 +345,7 @@ class User(UserMixin, db.Model):
         '''
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
-            app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+            current_app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
 
 
     @staticmethod
@@ -131,13 +355,16 @@ class User(UserMixin, db.Model):
         to a class method, with the only difference that static methods do not receive the class as a first argument
         '''
         try: # If the token is valid, then the value of the reset_password key from the token's payload is the ID of the user
-            id = jwt.decode(token, app.config['SECRET_KEY'],
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
                             algorithms=['HS256'])['reset_password']
         except:
             return
         return User.query.get(id)
 
 
+user_cache = UserCache(User)
+
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
@@ -148,9 +375,119 @@ class Post(db.Model):
     # of calling it)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
+    # a user's posts, newest first, without touching the rest of the table
+    __table_args__ = (db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),)
+
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
+    @staticmethod
+    def preload_authors(posts):
+        '''
+        _post.html reads post.author for every post, which would lazy load one user per
+        distinct author. This loads all the missing authors with a single IN query and
+        attaches them to the posts, so a page costs the same number of queries no matter
+        how many authors are on it.
+        '''
+        authors = Post.load_authors(post.user_id for post in posts)
+        for post in posts:
+            set_committed_value(post, 'author', authors.get(post.user_id))
+        return posts
+
+    @staticmethod
+    def load_authors(user_ids):
+        '''{id: user} for the ids, reusing the users already in the session'''
+        authors = {}
+        for id in user_ids:
+            if id not in authors:
+                key = User.__mapper__.identity_key_from_primary_key([id])
+                authors[id] = db.session.identity_map.get(key)
+        missing = [id for id, author in authors.items() if author is None]
+        if missing:
+            authors.update((user.id, user) for user in User.query.filter(User.id.in_(missing)))
+        return authors
+
+    @staticmethod
+    def search(expression, cursor=None, per_page=None):
+        '''
+        Full-text search over the post bodies, best matches first (bm25 rank from the
+        post_fts index), as a KeysetPage whose cursors hold (rank, id). Every word of the
+        expression has to match; FTS5 query syntax is not exposed to users.
+        '''
+        per_page = per_page or current_app.config['POSTS_PER_PAGE']
+        terms = re.findall(r'\w+', expression or '')
+        if not terms:
+            return KeysetPage([], False, False)
+        params = {'match': ' '.join('"{}"'.format(term) for term in terms),
+                  'limit': per_page + 1}
+        direction, where, order = 'f', '', 'ASC'
+        if cursor:
+            direction, values = decode_cursor(cursor)
+            try:
+                params['rank'], params['id'] = float(values[0]), int(values[1])
+            except (ValueError, TypeError, IndexError):
+                abort(404)
+            op, order = ('>', 'ASC') if direction == 'n' else ('<', 'DESC')
+            where = ('AND (bm25(post_fts) {0} :rank OR '
+                     '(bm25(post_fts) = :rank AND rowid {0} :id))').format(op)
+        hits = db.session.execute(
+            'SELECT rowid, bm25(post_fts) AS rank FROM post_fts WHERE post_fts MATCH :match '
+            '{0} ORDER BY rank {1}, rowid {1} LIMIT :limit'.format(where, order), params).fetchall()
+        posts = {post.id: post for post in Post.query.filter(
+            Post.id.in_([hit.rowid for hit in hits]))}
+        rows = []
+        for hit in hits:
+            post = posts[hit.rowid]
+            post.search_rank = hit.rank
+            rows.append(post)
+        return KeysetPage.from_rows(rows, direction, per_page,
+                                    key=lambda post: [post.search_rank, post.id])
+
+    @staticmethod
+    def rebuild_search_index(after_id, limit):
+        '''
+        Adds the next limit posts with an id above after_id to the (emptied) search index.
+        Returns the last id processed, or None when there are no posts left.
+        '''
+        last_id = db.session.query(db.func.max(Post.id)).filter(Post.id.in_(
+            db.select([Post.id]).where(Post.id > after_id).order_by(Post.id).limit(
+                limit))).scalar()
+        if last_id is None:
+            return None
+        db.session.execute(
+            'INSERT INTO post_fts (rowid, body) SELECT id, body FROM post '
+            'WHERE id > :after_id AND id <= :last_id', {'after_id': after_id, 'last_id': last_id})
+        return last_id
+
+
+class TrendingSnapshot(db.Model):
+    '''the last saved state of an in-memory trending summary, see app/trending.py'''
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), index=True, unique=True)
+    data = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<TrendingSnapshot {}>'.format(self.name)
+
+
+# Full-text index of the post bodies: an SQLite FTS5 table that reads its content from the
+# post table, kept in sync by triggers on insert, update and delete (the migration creates
+# the same objects, these listeners cover db.create_all())
+for statement in (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+        "body, content='post', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_fts (rowid, body) VALUES (new.id, new.body); END",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF body ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+        "INSERT INTO post_fts (rowid, body) VALUES (new.id, new.body); END"):
+    db.event.listen(Post.__table__, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+db.event.listen(Post.__table__, 'before_drop',
+                db.DDL('DROP TABLE IF EXISTS post_fts').execute_if(dialect='sqlite'))
+
 
 
 '''
@@ -0,0 +1,117 @@
+import base64
+import json
+from datetime import datetime
+from flask import abort, url_for
+from app import db
+
+'''
+Keyset (cursor) pagination.
+
+Query.paginate() uses LIMIT/OFFSET plus a COUNT(*) of the whole result, so the cost of a
+page grows with its depth and with the size of the table. Here a page is instead described
+by the (timestamp, id) of the post next to it: the query seeks straight to that key through
+the timestamp index and reads per_page + 1 rows, so every page costs the same and no count
+is needed. The key is sent to the browser as an opaque urlsafe string.
+'''
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(direction, values):
+    # direction is 'n' (older posts, the next page) or 'p' (newer posts, the previous page)
+    raw = json.dumps([direction] + list(values), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''returns (direction, values), or aborts with a 404 for a tampered cursor'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if data[0] not in ('n', 'p'):
+            raise ValueError(cursor)
+        return data[0], data[1:]
+    except (ValueError, TypeError, IndexError, UnicodeError):
+        abort(404)
+
+
+def decode_post_cursor(cursor):
+    direction, values = decode_cursor(cursor)
+    try:
+        return direction, (datetime.strptime(values[0], TIMESTAMP_FORMAT), int(values[1]))
+    except (ValueError, TypeError, IndexError):
+        abort(404)
+
+
+def keyset_filter(timestamp_col, id_col, key, older):
+    '''rows strictly older (or newer) than key in (timestamp, id) order'''
+    timestamp, id = key
+    if older:
+        return db.or_(timestamp_col < timestamp,
+                      db.and_(timestamp_col == timestamp, id_col < id))
+    return db.or_(timestamp_col > timestamp,
+                  db.and_(timestamp_col == timestamp, id_col > id))
+
+
+def post_key(post):
+    return [post.timestamp.strftime(TIMESTAMP_FORMAT), post.id]
+
+
+class KeysetPage(object):
+    '''
+    One page of posts, newest first. has_next means there are older posts and has_prev
+    means there are newer posts, matching the pager in the templates. key gives the
+    cursor values of a post, (timestamp, id) unless the page is ordered by something else.
+    '''
+    def __init__(self, items, has_next, has_prev, key=post_key):
+        self.items = items
+        self.has_next = has_next and bool(items)
+        self.has_prev = has_prev and bool(items)
+        self.next_cursor = encode_cursor('n', key(items[-1])) if self.has_next else None
+        self.prev_cursor = encode_cursor('p', key(items[0])) if self.has_prev else None
+
+    @classmethod
+    def from_rows(cls, rows, direction, per_page, key=post_key):
+        '''
+        rows were read in the direction of travel with one extra row, which tells if
+        there is another page past this one.
+        '''
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == 'p':
+            return cls(rows[::-1], has_next=True, has_prev=more, key=key)
+        return cls(rows, has_next=more, has_prev=direction == 'n', key=key)
+
+
+def keyset_paginate(query, timestamp_col, id_col, cursor, per_page):
+    '''
+    Returns the page of the (unordered) query that follows cursor, or the first page when
+    cursor is None.
+    '''
+    direction = 'f'
+    if cursor:
+        direction, key = decode_post_cursor(cursor)
+        query = query.filter(keyset_filter(timestamp_col, id_col, key, direction == 'n'))
+    if direction == 'p':
+        query = query.order_by(timestamp_col.asc(), id_col.asc())
+    else:
+        query = query.order_by(timestamp_col.desc(), id_col.desc())
+    return KeysetPage.from_rows(query.limit(per_page + 1).all(), direction, per_page)
+
+
+def pagination_urls(endpoint, posts, **values):
+    '''
+    next_url and prev_url for either kind of page: cursor links for a KeysetPage and the
+    older ?page= links for a Flask-SQLAlchemy Pagination.
+    '''
+    if isinstance(posts, KeysetPage):
+        next_url = url_for(endpoint, cursor=posts.next_cursor, **values) \
+            if posts.has_next else None
+        prev_url = url_for(endpoint, cursor=posts.prev_cursor, **values) \
+            if posts.has_prev else None
+    else:
+        next_url = url_for(endpoint, page=posts.next_num, **values) \
+            if posts.has_next else None
+        prev_url = url_for(endpoint, page=posts.prev_num, **values) \
+            if posts.has_prev else None
+    return next_url, prev_url
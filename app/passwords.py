@@ -0,0 +1,73 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
+
+'''
+Password hashing service.
+
+PBKDF2 is deliberately slow and runs in Python while holding the GIL, so hashing inside the
+login, register and reset_password views used to stall every other thread of the worker.
+PasswordHasher sends the derivations to a small pool of processes instead. The number of
+derivations waiting for the pool is bounded: once PASSWORD_POOL_SIZE * PASSWORD_POOL_BACKLOG
+are in flight a caller waits for a free slot (backpressure), and gives up with
+PasswordHasherBusy after PASSWORD_POOL_TIMEOUT seconds.
+
+The cost comes from PASSWORD_HASH_METHOD. Hashes made with an older setting still verify,
+and needs_rehash() tells the login view to replace them with one at the current cost.
+A PASSWORD_POOL_SIZE of 0 hashes in the calling thread, which is what the tests use.
+'''
+
+
+class PasswordHasherBusy(RuntimeError):
+    pass
+
+
+class PasswordHasher(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.slots = None
+        self.pid = None
+
+    def pool(self):
+        size = current_app.config['PASSWORD_POOL_SIZE']
+        if size <= 0:
+            return None
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid(): # a forked worker needs its own pool
+                self.executor = ProcessPoolExecutor(max_workers=size)
+                self.slots = threading.BoundedSemaphore(size * current_app.config['PASSWORD_POOL_BACKLOG'])
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, func, *args):
+        executor = self.pool()
+        if executor is None:
+            return func(*args)
+        if not self.slots.acquire(timeout=current_app.config['PASSWORD_POOL_TIMEOUT']):
+            raise PasswordHasherBusy('password hashing pool is saturated')
+        try:
+            return executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+    def verify(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # the stored hash starts with the method it was made with, "pbkdf2:sha256:150000$..."
+        return pwhash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,126 @@
+import threading
+from collections import deque, namedtuple
+from flask import Blueprint, current_app
+from app.models import Post
+from app.pagination import KeysetPage, decode_post_cursor
+
+'''
+Ring buffer of the newest posts, for the explore page.
+
+Every viewer of /explore asks for the same newest posts, so the first RECENT_POSTS_SIZE
+of them are kept in memory as plain RecentPost tuples (no session, no lazy loading), newest
+last. index() appends the posts written through this process, and the explore view serves
+its cursor pages from the buffer as long as the buffer holds the whole page; older pages
+go to the database as before.
+
+Other worker processes write posts this buffer never sees. Before each page sync() is given
+the highest post id in the database (explore reads it anyway for its ETag) and loads any
+post above the highest id it has synced so far, so every process catches up with one small
+indexed query, and with none at all when nothing was posted. If the database went backwards
+(it was replaced, as in the tests), or more posts were written than the buffer holds, the
+buffer is loaded again from scratch.
+'''
+
+RecentPost = namedtuple('RecentPost', ['id', 'user_id', 'body', 'timestamp', 'author'])
+
+
+def _key(post):
+    return (post.timestamp, post.id)
+
+
+class RecentPosts(object):
+    def __init__(self, size=None):
+        self.size = size
+        self.lock = threading.Lock()
+        self.posts = deque(maxlen=size) # oldest first, sized by warm()
+        self.ids = set()
+        self.synced_id = None # highest post id read from the database, None before warm()
+
+    def maxlen(self):
+        return self.size or current_app.config['RECENT_POSTS_SIZE']
+
+    def clear(self):
+        with self.lock:
+            self.posts = deque(maxlen=self.size)
+            self.ids.clear()
+            self.synced_id = None
+
+    def _add(self, post):
+        # called with the lock held
+        if post.id in self.ids:
+            return
+        record = RecentPost(post.id, post.user_id, post.body, post.timestamp, None)
+        if self.posts and _key(record) < _key(self.posts[-1]):
+            # out of order (clocks of two workers), rare enough to just sort again
+            posts = sorted(list(self.posts) + [record], key=_key)[-self.posts.maxlen:]
+            self.posts = deque(posts, maxlen=self.posts.maxlen)
+            self.ids = {post.id for post in self.posts}
+            return
+        if len(self.posts) == self.posts.maxlen:
+            self.ids.discard(self.posts[0].id) # about to fall off the other end
+        self.posts.append(record)
+        self.ids.add(record.id)
+
+    def append(self, post):
+        '''a post just committed by this process'''
+        with self.lock:
+            if self.synced_id is not None:
+                self._add(post)
+
+    def warm(self):
+        rows = Post.query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(
+            self.maxlen()).all()
+        with self.lock:
+            self.posts = deque(maxlen=self.maxlen())
+            self.ids = set()
+            for post in reversed(rows):
+                self._add(post)
+            self.synced_id = max(self.ids) if self.ids else 0
+
+    def sync(self, max_id):
+        '''catch up with the posts written by other processes, max_id is the newest in the db'''
+        max_id = max_id or 0
+        if self.synced_id is None or max_id < self.synced_id:
+            self.warm()
+        elif max_id - self.synced_id >= self.maxlen():
+            self.warm() # more new posts than the buffer holds, the old ones are all gone
+        elif max_id > self.synced_id:
+            rows = Post.query.filter(Post.id > self.synced_id).order_by(Post.id.desc()).limit(
+                self.maxlen()).all()
+            with self.lock:
+                for post in rows:
+                    self._add(post)
+                self.synced_id = max(self.synced_id, max_id)
+
+    def page(self, cursor, per_page):
+        '''
+        The KeysetPage for cursor (see app/pagination.py) with the authors loaded, or None
+        when the buffer does not hold all of it.
+        '''
+        direction, key = decode_post_cursor(cursor) if cursor else ('f', None)
+        with self.lock:
+            posts = list(self.posts)
+            complete = len(posts) < self.posts.maxlen # the buffer holds every post there is
+        if direction == 'p':
+            if not complete and (not posts or key < _key(posts[0])):
+                return None
+            rows = [post for post in posts if _key(post) > key][:per_page + 1]
+        else:
+            if key is not None:
+                posts = [post for post in posts if _key(post) < key]
+            rows = posts[::-1][:per_page + 1]
+            if len(rows) <= per_page and not complete:
+                return None
+        authors = Post.load_authors(post.user_id for post in rows)
+        rows = [post._replace(author=authors.get(post.user_id)) for post in rows]
+        return KeysetPage.from_rows(rows, direction, per_page)
+
+
+recent_posts = RecentPosts()
+
+bp = Blueprint('recent', __name__)
+
+
+@bp.before_app_first_request
+def warm_recent_posts():
+    recent_posts.warm()
@@ -0,0 +1,113 @@
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from flask import Blueprint, current_app, g, request
+from flask_login import current_user
+
+'''
+On-demand sampling profiler for live requests.
+
+A request is profiled when an admin (a user whose email is in ADMINS) sends the
+X-Profile header or the ?profile=1 query flag, or at random for a PROFILER_SAMPLE_RATE share
+of all requests. While the view runs (including the template rendering) a background thread
+looks at the request thread's stack every PROFILER_INTERVAL seconds through
+sys._current_frames() and counts each distinct stack. The request itself is not slowed
+down by tracing hooks, it only loses the GIL to the sampler for a moment at every sample.
+
+The counts are written in the collapsed stack format, one "frame;frame;frame count" line per
+stack, to PROFILER_DIR, ready for flamegraph.pl or speedscope:
+
+    $ flamegraph.pl logs/profiles/20181016-101530-123456-main.explore-4242.folded > explore.svg
+
+Admins get the name of the file back in the X-Profile-File header. When profiling is off,
+a request only pays for a header lookup and a config lookup.
+'''
+
+
+def collapse(frame):
+    '''the stack of frame as "module:function;module:function", outermost first'''
+    names = []
+    while frame is not None:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'),
+                                    frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame)] += 1
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            self.thread.join()
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+bp = Blueprint('sampling_profiler', __name__)
+
+
+def profile_requested():
+    ''''admin' when an admin asked for a profile, 'sampled' when picked at random, or None'''
+    if 'X-Profile' in request.headers or request.args.get('profile'):
+        # only now look at the user, so a normal request pays nothing for this
+        if current_user.is_authenticated and current_user.email in current_app.config['ADMINS']:
+            return 'admin'
+    rate = current_app.config['PROFILER_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return 'sampled'
+    return None
+
+
+@bp.before_app_request
+def start_profiler():
+    reason = profile_requested()
+    if reason is None:
+        return
+    g.profile_reason = reason
+    name = '{}-{}-{}.folded'.format(datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f'),
+                                   request.endpoint or 'unknown', os.getpid())
+    g.profile_path = os.path.join(current_app.config['PROFILER_DIR'], name)
+    g.sampler = StackSampler(threading.get_ident(), current_app.config['PROFILER_INTERVAL']).start()
+
+
+@bp.after_app_request
+def stop_profiler(response):
+    sampler = g.get('sampler')
+    if sampler is not None:
+        sampler.stop()
+        sampler.write(g.profile_path)
+        if g.profile_reason == 'admin':
+            response.headers['X-Profile-File'] = os.path.basename(g.profile_path)
+    return response
+
+
+@bp.teardown_app_request
+def stop_sampler_thread(exc):
+    # after_request does not run when the view raised, the thread still has to go
+    sampler = g.get('sampler')
+    if sampler is not None:
+        sampler.stop()
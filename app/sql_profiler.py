@@ -0,0 +1,112 @@
+import heapq
+from collections import Counter
+from time import perf_counter
+from flask import Blueprint, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Per-request SQL profiler.
+
+Two engine events time every statement and add it to the SQLStats of the current request
+(kept on flask.g, statements run outside of a request are ignored). For each request it
+knows the number of statements, the total time spent in the database, the slowest few
+statements, and how many times each distinct statement ran. The SQL text still has its
+placeholders, so the same query with different parameters is the same "shape", and a shape
+that runs SQL_REPEATED_THRESHOLD times or more in one request is the usual N+1 pattern (a
+lazy load inside a loop over the page).
+
+In debug mode (or with SQL_PROFILER_HEADERS) the numbers are sent in response headers:
+
+    X-SQL-Queries: 5
+    X-SQL-Time: 3.104 ms
+    X-SQL-Repeated: 1
+
+In production a request slower than SQL_SLOW_REQUEST_MS is logged through the app logger with
+the repeated shapes and the slowest statements, and nothing else is done.
+'''
+
+
+class SQLStats(object):
+    def __init__(self, keep=3):
+        self.keep = keep
+        self.count = 0
+        self.total = 0.0 # seconds
+        self.shapes = Counter()
+        self.slowest = [] # min-heap of (seconds, statement)
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.total += seconds
+        self.shapes[statement] += 1
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    def repeated(self, threshold):
+        '''[(statement, times)] of the shapes that ran at least threshold times'''
+        return [(statement, n) for statement, n in self.shapes.most_common() if n >= threshold]
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    seconds = perf_counter() - conn.info['statement_start'].pop()
+    if has_request_context():
+        stats = g.get('sql_stats')
+        if stats is not None:
+            stats.add(statement, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def fail_statement(context):
+    # after_cursor_execute does not run for a statement that failed
+    starts = context.connection.info.get('statement_start') if context.connection else None
+    if context.cursor is not None and starts:
+        starts.pop()
+
+
+bp = Blueprint('sql_profiler', __name__)
+
+
+@bp.before_app_request
+def start_sql_profile():
+    if current_app.config['SQL_PROFILER']:
+        g.sql_stats = SQLStats(current_app.config['SQL_SLOWEST'])
+        g.request_start = perf_counter()
+
+
+def shorten(statement, length=200):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+
+@bp.after_app_request
+def report_sql_profile(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    repeated = stats.repeated(current_app.config['SQL_REPEATED_THRESHOLD'])
+    if current_app.debug or current_app.config['SQL_PROFILER_HEADERS']:
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['X-SQL-Time'] = '{:.3f} ms'.format(stats.total * 1000)
+        response.headers['X-SQL-Repeated'] = str(len(repeated))
+    elapsed = (perf_counter() - g.request_start) * 1000
+    if elapsed >= current_app.config['SQL_SLOW_REQUEST_MS']:
+        lines = ['Slow request {} {} ({}): {:.1f} ms, {} queries in {:.1f} ms'.format(
+            request.method, request.path, request.endpoint, elapsed, stats.count,
+            stats.total * 1000)]
+        lines.extend('  repeated {} times: {}'.format(n, shorten(statement))
+                     for statement, n in repeated)
+        lines.extend('  {:.1f} ms: {}'.format(seconds * 1000, shorten(statement))
+                     for seconds, statement in stats.slowest_statements())
+        current_app.logger.warning('\n'.join(lines))
+    return response
@@ -0,0 +1,132 @@
+import json
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from time import time
+from sqlalchemy.exc import SQLAlchemyError
+from flask import current_app
+from app import db
+from app.models import TrendingSnapshot
+
+'''
+Trending hashtags for the explore page.
+
+Counting every hashtag ever posted would need memory (or a scan of the post table) that grows
+with the data. Instead each new post's hashtags go into a Space-Saving summary: at most
+TRENDING_CAPACITY counters, and when a new tag arrives with all of them in use it takes over
+the smallest counter (inheriting its count as the possible overestimate). Tags that are
+really frequent always survive, which is all a "top 10" needs.
+
+To make old tags fade out, time is cut into TRENDING_BUCKETS slices of TRENDING_WINDOW /
+TRENDING_BUCKETS seconds with one summary each, and the oldest slice is dropped as the window
+slides. Memory is fixed at buckets x capacity counters no matter how much is posted.
+
+Every TRENDING_SNAPSHOT_INTERVAL seconds the buckets are saved to the trending_snapshot
+table, and they are loaded back the first time they are needed after a restart.
+'''
+
+HASHTAG = re.compile(r'#(\w+)', re.UNICODE)
+
+
+def hashtags(body):
+    return {tag.lower() for tag in HASHTAG.findall(body or '')}
+
+
+class SpaceSaving(object):
+    def __init__(self, capacity, counts=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            self.counts[item] = self.counts.pop(smallest) + count
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+class TrendingTags(object):
+    def __init__(self, name='hashtags'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.buckets = deque() # (start time, SpaceSaving), oldest first
+        self.loaded = False
+        self.last_snapshot = time()
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.loaded = False
+
+    def bucket_seconds(self):
+        return current_app.config['TRENDING_WINDOW'] / current_app.config['TRENDING_BUCKETS']
+
+    def expire(self, now):
+        # drop the slices that have slid out of the window
+        while self.buckets and self.buckets[0][0] <= now - current_app.config['TRENDING_WINDOW']:
+            self.buckets.popleft()
+
+    def add(self, tags, now=None):
+        now = now or time()
+        self.load()
+        with self.lock:
+            self.expire(now)
+            start = now - now % self.bucket_seconds()
+            if not self.buckets or self.buckets[-1][0] != start:
+                self.buckets.append((start, SpaceSaving(current_app.config['TRENDING_CAPACITY'])))
+            for tag in tags:
+                self.buckets[-1][1].add(tag)
+        if now - self.last_snapshot >= current_app.config['TRENDING_SNAPSHOT_INTERVAL']:
+            self.snapshot(now)
+
+    def add_post(self, post):
+        tags = hashtags(post.body)
+        if tags:
+            self.add(tags)
+
+    def top(self, n=10, now=None):
+        self.load()
+        totals = {}
+        with self.lock:
+            self.expire(now or time())
+            for start, summary in self.buckets:
+                for tag, count in summary.counts.items():
+                    totals[tag] = totals.get(tag, 0) + count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def snapshot(self, now=None):
+        with self.lock:
+            data = json.dumps([[start, summary.counts] for start, summary in self.buckets])
+            self.last_snapshot = now or time()
+        try:
+            row = TrendingSnapshot.query.filter_by(name=self.name).first()
+            if row is None:
+                row = TrendingSnapshot(name=self.name)
+                db.session.add(row)
+            row.data = data
+            row.timestamp = datetime.utcnow()
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception('Could not save the trending snapshot')
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        row = TrendingSnapshot.query.filter_by(name=self.name).first()
+        if row is None:
+            return
+        capacity = current_app.config['TRENDING_CAPACITY']
+        with self.lock:
+            self.buckets = deque((start, SpaceSaving(capacity, counts))
+                                 for start, counts in json.loads(row.data))
+
+
+trending_tags = TrendingTags()
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import manager_of_class, set_committed_value
+from flask import current_app
+from app import db
+
+'''
+Cache for the user loader (the instance is user_cache in app/models.py).
+
+Flask-Login calls load_user() at the start of every authenticated request, and it used to
+run a SELECT on the user table each time. This keeps detached snapshots of recently seen
+users (the column values only) in a bounded LRU with a time to live. A cache hit is merged
+back into the session with load=False, which does not touch the database.
+
+Views that change a user row call invalidate() after their commit. Every invalidation bumps
+a version stamp, and a snapshot read from the database is only stored if the stamp did not
+move while it was being loaded, so a slow reader cannot put back data that was just
+invalidated. Other processes only find out about a change when their entry expires, so
+USER_CACHE_TTL is the worst case staleness.
+'''
+
+
+class UserCache(object):
+    def __init__(self, model, maxsize=None, ttl=None):
+        self.model = model
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # id -> (snapshot, expires)
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, id):
+        with self.lock:
+            entry = self.entries.get(id)
+            if entry is None or entry[1] < monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user, version):
+        # not self.model(...), the constructor would run the @validates hooks on the stored values
+        snapshot = manager_of_class(self.model).new_instance()
+        for column in self.model.__table__.columns:
+            set_committed_value(snapshot, column.key, getattr(user, column.key))
+        make_transient_to_detached(snapshot)
+        ttl = self.ttl or current_app.config['USER_CACHE_TTL']
+        with self.lock:
+            if version != self.version:
+                return # invalidated while it was loading
+            self.entries[user.id] = (snapshot, monotonic() + ttl)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > (self.maxsize or current_app.config['USER_CACHE_SIZE']):
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *ids):
+        with self.lock:
+            self.version += 1
+            for id in ids:
+                self.entries.pop(id, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def load(self, id):
+        '''returns the user with this id attached to the current session, or None'''
+        snapshot = self.get(id)
+        if snapshot is not None:
+            return db.session.merge(snapshot, load=False)
+        version = self.version
+        user = self.model.query.get(id)
+        if user is not None:
+            self.put(user, version)
+        return user
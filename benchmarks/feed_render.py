@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import render_template
+from config import Config
+from app import create_app, db
+from app.fragments import fragment_cache
+from app.models import User, Post
+
+'''
+Render time of a feed page with and without the post fragment cache.
+
+Builds an in-memory database with a handful of authors and renders index.html for one page
+of posts over and over, first with FRAGMENT_CACHE_SIZE = 0 (every post goes through
+_post.html) and then with the cache on. Reports milliseconds per page.
+
+(venv) $ python -m benchmarks.feed_render --per-page 25 --renders 500
+'''
+
+
+class BenchmarkConfig(Config):
+    TESTING = True # no log files in the current directory, see configure_logging()
+
+
+def setup(per_page):
+    db.create_all()
+    authors = [User(username='author{}'.format(i), email='author{}@example.com'.format(i))
+               for i in range(10)]
+    db.session.add_all(authors)
+    now = datetime.utcnow()
+    db.session.add_all([Post(body='post number {}'.format(i), author=authors[i % 10],
+                             timestamp=now - timedelta(seconds=i)) for i in range(per_page)])
+    db.session.commit()
+    posts = Post.query.order_by(Post.timestamp.desc()).limit(per_page).all()
+    Post.preload_authors(posts)
+    return posts
+
+
+def run(app, posts, cache_size, renders):
+    app.config['FRAGMENT_CACHE_SIZE'] = cache_size
+    fragment_cache.clear()
+    with app.test_request_context('/'):
+        render_template('index.html', title='Home', posts=posts) # warm the template cache
+        start = time.perf_counter()
+        for i in range(renders):
+            render_template('index.html', title='Home', posts=posts)
+        elapsed = time.perf_counter() - start
+    return elapsed * 1000 / renders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed page render time with the fragment cache.')
+    parser.add_argument('--per-page', type=int, default=25)
+    parser.add_argument('--renders', type=int, default=500)
+    args = parser.parse_args()
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        posts = setup(args.per_page)
+        app.try_trigger_before_first_request_functions() # sets up Flask-Moment
+        print('{} posts per page, {} renders'.format(args.per_page, args.renders))
+        print('fragment cache off: {:8.3f} ms/page'.format(run(app, posts, 0, args.renders)))
+        print('fragment cache on:  {:8.3f} ms/page'.format(run(app, posts, 5000, args.renders)))
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from app.metrics import RequestMetrics
+
+'''
+Cost of recording one request in the /metrics histograms.
+
+Calls RequestMetrics.observe() the way the after_request hook does, from 1 thread and then
+from several at once (the shards mean the threads never wait for each other), and reports
+microseconds per call. The empty loop is measured too, so the difference is the real cost.
+
+(venv) $ python -m benchmarks.metrics --calls 200000 --threads 1 4
+'''
+
+ENDPOINTS = ['index', 'explore', 'user', 'login', 'search']
+
+
+def run(metrics, calls, threads):
+    def worker():
+        observe = metrics.observe
+        for i in range(calls):
+            observe(ENDPOINTS[i % 5], 'GET', 200, (i % 1000) / 2000.0)
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (calls * threads) * 1e6
+
+
+def baseline(calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        (ENDPOINTS[i % 5], 'GET', 200, (i % 1000) / 2000.0)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of recording a request metric.')
+    parser.add_argument('--calls', type=int, default=200000, help='calls per thread')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+    print('empty loop:        {:6.3f} us/call'.format(baseline(args.calls)))
+    for threads in args.threads:
+        metrics = RequestMetrics(Config.METRICS_BUCKETS)
+        print('observe, {:>2} thread{}: {:6.3f} us/call'.format(
+            threads, ' ' if threads == 1 else 's', run(metrics, args.calls, threads)))
+        counts, histograms = metrics.collect()
+        assert sum(counts.values()) == args.calls * threads # nothing lost between threads
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from app import create_app
+from app.passwords import password_hasher
+
+'''
+Login throughput of the password hashing service.
+
+Simulates a burst of logins: THREADS request threads each verify a password against a hash
+made with PASSWORD_HASH_METHOD, for every pool size given on the command line (0 means
+hashing in the request thread, like before the pool existed). Reports logins/sec.
+
+(venv) $ python -m benchmarks.password_hashing --sizes 0 1 2 4 --logins 200
+'''
+
+
+def run(app, pool_size, logins, threads):
+    app.config['PASSWORD_POOL_SIZE'] = pool_size
+    pwhash = password_hasher.hash('cat')
+    remaining = [logins]
+    lock = threading.Lock()
+
+    def worker():
+        with app.app_context(): # like a request thread
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                assert password_hasher.verify(pwhash, 'cat')
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    password_hasher.shutdown()
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput per hashing pool size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--method', default=Config.PASSWORD_HASH_METHOD)
+    args = parser.parse_args()
+    app = create_app()
+    app.config['PASSWORD_HASH_METHOD'] = args.method
+    print('method {}, {} logins over {} threads'.format(args.method, args.logins, args.threads))
+    with app.app_context():
+        for size in args.sizes:
+            print('pool size {:>2}: {:8.1f} logins/sec'.format(
+                size, run(app, size, args.logins, args.threads)))
+
+
+if __name__ == '__main__':
+    main()
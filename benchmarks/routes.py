@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from flask import current_app
+from config import Config
+from app import create_app, db
+from app.bulk import insert_chunks, power_law, pick, rebuild
+from app.last_seen import last_seen_buffer
+from app.models import User, Post, followers, email_digest
+
+'''
+Latency and queries per request of the hot paths, at a configurable scale.
+
+Seeds a fresh SQLite database (a temporary file, so the disk is involved like in production)
+with USERS users who wrote POSTS_PER_USER posts each and follow FANOUT others each, picked
+with a power law so a few users are very popular. Then it logs in as user1 through the Flask
+test client and requests every route REQUESTS times after a few warm-up requests, and
+reports the p50/p95/p99 latency and the number of SQL statements per request. The first
+page of followed_posts() (the pull path, one query per followed author) is measured on its
+own as well.
+
+(venv) $ python -m benchmarks.routes --users 1000 --posts-per-user 50 --fanout 100 \
+    --save baseline.json
+... change something ...
+(venv) $ python -m benchmarks.routes --users 1000 --posts-per-user 50 --fanout 100 \
+    --compare baseline.json
+
+--compare exits with status 1 when a route got slower than --tolerance times its baseline
+p95 (1.25 by default, timings are noisy) or runs more queries than before.
+'''
+
+
+class BenchmarkConfig(Config):
+    TESTING = True # no log files in the current directory, see configure_logging()
+
+
+def seed(users, posts_per_user, fanout, seed=None, chunk_size=10000):
+    rng = random.Random(seed)
+    pwhash = generate_password_hash('cat', 'pbkdf2:sha256:1') # logging in is not measured
+    insert_chunks(User.__table__, ({
+        'id': id, 'username': 'user{}'.format(id), 'email': 'user{}@example.com'.format(id),
+        'avatar_hash': email_digest('user{}@example.com'.format(id)), 'password_hash': pwhash,
+        'last_seen': datetime.utcnow(), 'followers_count': 0, 'followed_count': 0,
+        'posts_count': 0, 'profile_version': 0, 'follow_version': 0}
+        for id in range(1, users + 1)), chunk_size)
+
+    start = datetime.utcnow() - timedelta(days=30)
+    step = timedelta(days=30) / max(users * posts_per_user, 1)
+    insert_chunks(Post.__table__, ({
+        'user_id': rng.randint(1, users), 'body': 'benchmark post {}'.format(i),
+        'timestamp': start + step * i} for i in range(users * posts_per_user)), chunk_size)
+
+    weights = power_law(users, 1.0)
+
+    def edges():
+        for follower in range(1, users + 1):
+            followed = set()
+            for attempt in range(fanout * 4):
+                if len(followed) >= min(fanout, users - 1):
+                    break
+                id = pick(rng, weights)
+                if id != follower:
+                    followed.add(id)
+            for id in sorted(followed):
+                yield {'follower_id': follower, 'followed_id': id}
+    insert_chunks(followers, edges(), chunk_size)
+    rebuild(User.reconcile_counters, chunk_size)
+    rebuild(User.rebuild_timelines, max(1, chunk_size // 100))
+
+
+def percentile(samples, p):
+    '''nearest rank percentile of a sorted list'''
+    return samples[min(len(samples) - 1, max(0, int(round(p / 100.0 * len(samples))) - 1))]
+
+
+def measure(call, requests, warmup):
+    '''runs call() warmup times, then requests times, timing it and counting its queries'''
+    for i in range(warmup):
+        call()
+    queries = []
+    listen = lambda *args: queries.append(args[2])
+    timings = []
+    event.listen(db.engine, 'before_cursor_execute', listen)
+    try:
+        for i in range(requests):
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listen)
+    timings.sort()
+    return {'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': round(len(queries) / requests, 2)}
+
+
+def run(args):
+    client = current_app.test_client()
+    response = client.post('/login', data={'username': 'user1', 'password': 'cat'})
+    assert response.status_code == 302, 'could not log in'
+    viewer = User.query.get(1)
+    popular = User.query.order_by(User.followers_count.desc()).first()
+
+    def get(url):
+        def call():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return call
+
+    def followed_posts():
+        list(islice(viewer.followed_posts(), current_app.config['POSTS_PER_PAGE']))
+
+    checks = [('followed_posts', followed_posts),
+              ('index', get('/index')),
+              ('explore', get('/explore')),
+              ('user', get('/user/' + popular.username))]
+    results = {}
+    for name, call in checks:
+        results[name] = measure(call, args.requests, args.warmup)
+        print('{:<15} p50 {p50_ms:8.2f} ms  p95 {p95_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  '
+              '{queries:5.1f} queries'.format(name, **results[name]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''the list of regressions of results against the baseline results'''
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * tolerance:
+            regressions.append('{}: p95 {:.2f} ms, was {:.2f} ms'.format(
+                name, result['p95_ms'], before['p95_ms']))
+        if result['queries'] > before['queries']:
+            regressions.append('{}: {} queries per request, was {}'.format(
+                name, result['queries'], before['queries']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and queries of the hot paths.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts-per-user', type=int, default=20)
+    parser.add_argument('--fanout', type=int, default=50, help='users followed by each user')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app = create_app(BenchmarkConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    app.config['PASSWORD_POOL_SIZE'] = 0
+    app.config['WTF_CSRF_ENABLED'] = False # the test client posts the login form directly
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1' # no rehash on login
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.users, args.posts_per_user, args.fanout, args.seed)
+        print('seeded {} users, {} posts, fan-out {} in {:.1f} s'.format(
+            args.users, args.users * args.posts_per_user, args.fanout,
+            time.perf_counter() - started))
+        results = run(args)
+        last_seen_buffer.flush() # before the database goes away
+        db.session.remove()
+        db.drop_all()
+    os.remove(os.path.join(directory, 'bench.db'))
+    os.rmdir(directory)
+
+    report = {'params': {'users': args.users, 'posts_per_user': args.posts_per_user,
+                         'fanout': args.fanout, 'requests': args.requests},
+              'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['params'] != report['params']:
+            print('warning: the baseline was run with {}'.format(baseline['params']))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('no regressions against {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''
+Startup time of a web worker and of the "flask" command.
+
+Every run is a fresh Python process, so nothing is cached between runs. For a web worker the
+child process reports how long it took to import the app package, to make the application
+with create_app() and to answer its first request (GET /login, which renders a page,
+so Flask-Moment and the logging handlers are set up by then). The "eager" row imports
+Flask-Migrate and Flask-Moment before anything else, which is what every process paid for
+when the extensions were set up at import time. For the command line it times the whole
+"flask --help" and "flask reconcile-counters --help" processes, again with and without
+importing Flask-Moment up front (the flask command imports Flask-Migrate for its "db" group
+either way). Medians of RUNS runs.
+
+(venv) $ python -m benchmarks.startup --runs 10
+'''
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == 'eager':
+    import flask_migrate, flask_moment
+from app import create_app, db
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+with app.app_context():
+    db.create_all() # the in-memory database is empty, this is not timed
+skipped = time.perf_counter() - created
+response = app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter() - skipped
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': served - created, 'total': served - start}))
+'''
+
+EAGER_CLI = '''
+import sys
+import flask_moment
+from flask.cli import main
+sys.argv[0] = 'flask'
+main(as_module=False)
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def environment():
+    env = dict(os.environ, DATABASE_URL='sqlite://', FLASK_APP=os.path.join(ROOT, 'microblog.py'))
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    env.pop('MAIL_SERVER', None) # no SMTP handler, it would not connect anyway
+    return env
+
+
+def worker(mode, runs, directory):
+    '''median seconds of each step of a web worker's startup'''
+    samples = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', WORKER, mode], cwd=directory,
+                                         env=environment(), stderr=subprocess.DEVNULL)
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return {step: median([sample[step] for sample in samples]) for step in samples[0]}
+
+
+def command(mode, args, runs, directory):
+    '''median seconds of a whole "flask ..." process'''
+    if mode == 'eager':
+        flask = [sys.executable, '-c', EAGER_CLI]
+    else:
+        flask = [sys.executable, '-m', 'flask']
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(flask + args, cwd=directory,
+                              env=environment(), stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the web worker and CLI.')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory: # the log files go there
+        for mode in ('eager', 'lazy'):
+            result = worker(mode, args.runs, directory)
+            print('web worker, {:<5}  import {:6.1f} ms  create_app {:6.1f} ms  '
+                  'first request {:6.1f} ms  total {:6.1f} ms'.format(
+                      mode, *[result[step] * 1000 for step in
+                              ('import', 'create_app', 'first_request', 'total')]))
+        for cli in (['--help'], ['reconcile-counters', '--help']):
+            for mode in ('eager', 'lazy'):
+                print('flask {:<28} {:<5}  total {:6.1f} ms'.format(
+                    ' '.join(cli), mode, command(mode, cli, args.runs, directory) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,8 +13,62 @@ class Config(object):
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['mross982@gmail.com']
+    # email delivery queue, see app/email.py
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 1000)
+    MAIL_QUEUE_TIMEOUT = 5 # seconds send_email() waits when the queue is full
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_BATCH_SIZE = 20
+    MAIL_RETRIES = 3
+    MAIL_RETRY_BACKOFF = 1.0 # seconds, doubled on each retry
+    MAIL_IDLE_TIMEOUT = 30 # seconds before an idle worker closes its SMTP connection
+    # "flask send-digest"
+    DIGEST_CHUNK_SIZE = 1000
+    DIGEST_CHECKPOINT = os.environ.get('DIGEST_CHECKPOINT') or os.path.join(basedir, 'digest.checkpoint')
+    DIGEST_BASE_URL = os.environ.get('DIGEST_BASE_URL') or 'http://localhost:5000'
+
+    # password hashing: werkzeug method (with its iteration count) and the process pool running it
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:150000'
+    PASSWORD_POOL_SIZE = int(os.environ.get('PASSWORD_POOL_SIZE') or os.cpu_count() or 1)
+    PASSWORD_POOL_BACKLOG = 4 # derivations allowed to wait per pool process
+    PASSWORD_POOL_TIMEOUT = 10 # seconds to wait for a free slot
+
+    # per-request SQL statistics (app/sql_profiler.py), sent as headers in debug mode
+    SQL_PROFILER = True
+    SQL_PROFILER_HEADERS = False # also send the headers outside of debug mode
+    SQL_SLOW_REQUEST_MS = int(os.environ.get('SQL_SLOW_REQUEST_MS') or 500) # logged when slower
+    SQL_REPEATED_THRESHOLD = 5 # same statement this many times in a request looks like N+1
+    SQL_SLOWEST = 3 # slowest statements included in the slow request log
+
+    # upper bounds (seconds) of the request duration histograms on /metrics
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # bearer token the scraper must send
+
+    # sampling profiler (app/sampling_profiler.py): admins ask for it with ?profile=1
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0) # share of requests
+    PROFILER_INTERVAL = 0.005 # seconds between stack samples
+    PROFILER_DIR = os.path.join(basedir, 'logs', 'profiles')
 
     POSTS_PER_PAGE = 10
+    # seconds a page's ETag stays valid at most, keep it well under WTF_CSRF_TIME_LIMIT
+    PAGE_VALIDATOR_TTL = 300
+    RECENT_POSTS_SIZE = int(os.environ.get('RECENT_POSTS_SIZE') or 1000) # newest posts kept for /explore
+    IMPORT_CHUNK_SIZE = 10000 # rows per executemany INSERT of "flask import-data"
+    IMPORT_TIMELINE_DAYS = int(os.environ.get('IMPORT_TIMELINE_DAYS') or 7) # days of posts import-data puts in timelines, 0 = all
+    EXPORT_CHUNK_SIZE = 1000 # rows fetched at a time by the /api export endpoints
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 5000) # rendered posts kept
+    # seconds between the batched writes of User.last_seen
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    # users kept by the Flask-Login user loader, and for how many seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    # authors with at least this many followers are pulled at read time instead of fanned out
+    FEED_CELEBRITY_THRESHOLD = int(os.environ.get('FEED_CELEBRITY_THRESHOLD') or 10000)
+
+    # trending hashtags: sliding window length (seconds), slices in it, counters per slice
+    TRENDING_WINDOW = 6 * 60 * 60
+    TRENDING_BUCKETS = 12
+    TRENDING_CAPACITY = 200
+    TRENDING_SNAPSHOT_INTERVAL = 60 # seconds between saves to the database
 
     LANGUAGES = ['en', 'es']
 '''
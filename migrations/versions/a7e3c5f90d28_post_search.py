@@ -0,0 +1,47 @@
+"""post search
+
+Revision ID: a7e3c5f90d28
+Revises: 5c9a1e7d3b62
+Create Date: 2026-10-17 12:40:13.671302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e3c5f90d28'
+down_revision = '5c9a1e7d3b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 full-text index over post.body, kept in sync by triggers. Search is SQLite only,
+    # like the listeners in app/models.py, other databases get no index
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE post_fts USING fts5("
+        "body, content='post', content_rowid='id')")
+    op.execute(
+        "CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_fts (rowid, body) VALUES (new.id, new.body); END")
+    op.execute(
+        "CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, body) VALUES ('delete', old.id, old.body); END")
+    op.execute(
+        "CREATE TRIGGER post_fts_update AFTER UPDATE OF body ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+        "INSERT INTO post_fts (rowid, body) VALUES (new.id, new.body); END")
+    # index the existing posts ("flask rebuild-search-index" does this in batches)
+    op.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER post_fts_update')
+    op.execute('DROP TRIGGER post_fts_delete')
+    op.execute('DROP TRIGGER post_fts_insert')
+    op.execute('DROP TABLE post_fts')
@@ -1,17 +1,51 @@
 from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
 import unittest
-from app import app, db
-from app.models import User, Post
+from unittest.mock import patch
+from flask import url_for
+from sqlalchemy import event
+from app import create_app, db
+from config import Config
+from app.models import User, Post, user_cache
+from app.api import posts_query, followers_query, following_query
+from app.feed import HybridFeed
+from app.fragments import FragmentCache, fragment_cache
+from app.digest import send_digests, write_checkpoint
+from app.email import _STOP, mail_queue, send_email
+from app.passwords import password_hasher
+from app.last_seen import LastSeenBuffer, last_seen_buffer
+from app.pagination import keyset_paginate
+from app.metrics import RequestMetrics, request_metrics
+from app.recent import RecentPosts, recent_posts
+from app.sampling_profiler import StackSampler
+from app.sql_profiler import SQLStats
+from app.trending import SpaceSaving, TrendingTags, hashtags, trending_tags
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://' # a database in memory, the db file is not changed
+    PASSWORD_POOL_SIZE = 0 # hash in this process
+
 
 class UserModelCase(unittest.TestCase):
     def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
-        # creates a database in memory and does not change the db file
+        # every test gets an application of its own, so config changes do not leak
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
         db.create_all()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
     def test_password_hashing(self):
         u = User(username='susan')
@@ -19,12 +53,58 @@ class UserModelCase(unittest.TestCase):
         self.assertFalse(u.check_password('dog'))
         self.assertTrue(u.check_password('cat'))
 
+    def test_password_pool(self):
+        self.app.config['PASSWORD_POOL_SIZE'] = 2
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        try:
+            u = User(username='susan')
+            u.set_password('cat')
+            self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(u.check_password('cat'))
+            self.assertFalse(u.check_password('dog'))
+        finally:
+            password_hasher.shutdown()
+
     def test_avatar(self):
         u = User(username='john', email='john@example.com')
         self.assertEqual(u.avatar(128), ('https://www.gravatar.com/avatar/'
                                          'd4c74594d841139328695756648b6bd6'
                                          '?d=identicon&s=128'))
 
+    def test_avatar_hash(self):
+        u = User(username='john', email='John@Example.com')
+        self.assertEqual(u.avatar_hash, 'd4c74594d841139328695756648b6bd6')
+        u.email = 'susan@example.com'
+        self.assertEqual(u.avatar(70), User(email='susan@example.com').avatar(70))
+        self.assertNotIn('d4c74594d841139328695756648b6bd6', u.avatar(70))
+
+    def test_profile_version(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.profile_version, 0)
+        u.username = 'john' # same value, nothing to invalidate
+        u.about_me = 'hi'
+        self.assertEqual(u.profile_version, 0)
+        u.username = 'johnny'
+        u.email = 'johnny@example.com'
+        db.session.commit()
+        self.assertEqual(u.profile_version, 2)
+
+    def test_fragment_cache(self):
+        cache = FragmentCache(maxsize=2)
+        renders = []
+        render = lambda: renders.append(1) or 'html'
+        for key in ('a', 'b', 'a', 'c', 'b'):
+            self.assertEqual(cache.get_or_render(key, render), 'html')
+        # 'b' was the least recently used when 'c' came in, so it had to be rendered again
+        self.assertEqual((cache.hits, cache.misses, len(renders)), (1, 4, 4))
+        self.assertEqual(list(cache.entries), ['c', 'b'])
+        cache.maxsize = 0 # disabled
+        cache.clear()
+        cache.get_or_render('a', render)
+        self.assertEqual(len(cache.entries), 0)
+
     def test_follow(self):
         u1 = User(username='john', email='john@example.com')
         u2 = User(username='susan', email='susan@example.com')
@@ -48,6 +128,66 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.followed.count(), 0)
         self.assertEqual(u2.followers.count(), 0)
 
+    def test_followed_ids(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+        [u.id for u in (u1, u2, u3)] # reload the users expired by the commit
+
+        with self.app.test_request_context():
+            queries = []
+            listen = lambda *args: queries.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listen)
+            try:
+                self.assertTrue(u1.is_following(u2))
+                self.assertFalse(u1.is_following(u3))
+                self.assertFalse(u1.is_following(u1))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listen)
+            self.assertEqual(len(queries), 1)
+
+            # follow() and unfollow() keep the set in step
+            u1.follow(u3)
+            self.assertTrue(u1.is_following(u3))
+            u1.unfollow(u2)
+            self.assertFalse(u1.is_following(u2))
+            db.session.commit()
+            self.assertEqual(u1.followed.all(), [u3])
+
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual((u1.followers_count, u1.followed_count, u1.posts_count), (0, 0, 0))
+
+        u1.follow(u2)
+        u2.publish('post from susan')
+        u2.publish('another post from susan')
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u2.posts_count, 2)
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 0)
+        self.assertEqual(u2.followers_count, 0)
+
+        # reconciling fixes counters that drifted
+        u1.follow(u2)
+        u2.posts_count = 7
+        db.session.commit()
+        self.assertEqual(User.reconcile_counters(0, 1), u1.id)
+        self.assertEqual(User.reconcile_counters(u1.id, 1), u2.id)
+        self.assertIsNone(User.reconcile_counters(u2.id, 1))
+        db.session.commit()
+        self.assertEqual((u2.followers_count, u2.posts_count), (1, 2))
+
     def test_follow_posts(self):
         # create four users
         u1 = User(username='john', email='john@example.com')
@@ -77,15 +217,857 @@ class UserModelCase(unittest.TestCase):
         db.session.commit()
 
         # check the followed posts of each user
-        f1 = u1.followed_posts().all()
-        f2 = u2.followed_posts().all()
-        f3 = u3.followed_posts().all()
-        f4 = u4.followed_posts().all()
+        f1 = list(u1.followed_posts())
+        f2 = list(u2.followed_posts())
+        f3 = list(u3.followed_posts())
+        f4 = list(u4.followed_posts())
         self.assertEqual(f1, [p2, p4, p1])
         self.assertEqual(f2, [p2, p3])
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def query_plan(self, query):
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        return [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql)]
+
+    def test_feed_query_plan(self):
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(u1)
+        db.session.commit()
+
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        u1.follow(u2)
+        db.session.commit()
+
+        # the pull path reads each author's posts in index order, nothing is sorted, also
+        # when it starts after a cursor key
+        statements = []
+        listen = lambda *args: statements.append((args[2], args[3]))
+        event.listen(db.engine, 'before_cursor_execute', listen)
+        try:
+            list(u1.followed_posts())
+            list(u1.followed_posts().iter_posts(key=(datetime.utcnow(), 1)))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listen)
+        self.assertTrue(any('followers.follower_id' in sql for sql, params in statements))
+        pulled = [(sql, params) for sql, params in statements if 'FROM post' in sql]
+        self.assertEqual(len(pulled), 4) # two authors, with and without the key
+        for sql, params in pulled:
+            plan = [row[-1] for row in db.session.connection().connection.execute(
+                'EXPLAIN QUERY PLAN ' + sql, params)]
+            self.assertTrue(any('ix_post_user_id_timestamp' in step for step in plan), plan)
+            self.assertFalse(any(step.startswith('SCAN') for step in plan), plan)
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+        # the timeline is a single range scan that comes out already sorted
+        plan = self.query_plan(u1.home_timeline())
+        self.assertTrue(any('ix_timeline_user_id_timestamp' in step for step in plan), plan)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def test_bulk_import(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['generate-data', directory, '--users', '30', '--posts',
+                                     '300', '--edges', '120', '--seed', '1', '--format', 'csv'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = runner.invoke(args=['import-data', '--users', directory + '/users.csv',
+                                     '--posts', directory + '/posts.csv', '--followers',
+                                     directory + '/followers.csv', '--chunk-size', '50'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('imported 300 post rows', result.output)
+
+        self.assertEqual(User.query.count(), 30)
+        u = User.query.get(1)
+        self.assertTrue(u.check_password('password')) # the precomputed hash
+        self.assertEqual(u.followers_count, u.followers.count())
+        self.assertGreater(u.followers_count, User.query.get(30).followers_count) # power law
+        # the posts are spread over 30 days, the timelines only get the last week's
+        week_ago = datetime.utcnow() - timedelta(days=self.app.config['IMPORT_TIMELINE_DAYS'])
+        for user in User.query:
+            self.assertEqual(user.posts_count, user.posts.count())
+            self.assertEqual([post.id for post in user.home_timeline()],
+                             [post.id for post in user.followed_posts()
+                              if post.timestamp > week_ago], user.username)
+
+        # --timeline-days 0 rebuilds them with every post
+        result = runner.invoke(args=['import-data', '--timeline-days', '0'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        for user in User.query:
+            self.assertEqual([post.id for post in user.home_timeline()],
+                             [post.id for post in user.followed_posts()], user.username)
+
+        # one executemany INSERT cannot take rows with and without an id
+        path = os.path.join(directory, 'mixed.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"username": "ann"}\n{"id": 99, "username": "bob"}\n')
+        result = runner.invoke(args=['import-data', '--users', path])
+        self.assertIsInstance(result.exception, ValueError)
+        self.assertIsNone(User.query.filter_by(username='bob').first())
+
+    def test_export_query_plans(self):
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(u1)
+        db.session.commit()
+        # every export reads an index in the order it streams the rows, nothing is sorted
+        for query, index in ((posts_query(u1), 'ix_post_user_id_timestamp'),
+                             (followers_query(u1), 'ix_followers_followed_id_follower_id'),
+                             (following_query(u1), 'uq_followers_follower_id_followed_id')):
+            plan = self.query_plan(query)
+            self.assertTrue(any(index in step for step in plan), plan)
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def test_home_timeline(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        # susan posts before john follows her, mary posts after
+        p1 = u2.publish('post from susan')
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u3)
+        db.session.commit()
+        p2 = u3.publish('post from mary')
+        p3 = u1.publish('post from john')
+        db.session.commit()
+
+        # fan-out on write and backfill on follow give the same feed as the pull query
+        self.assertEqual(u1.home_timeline().all(), list(u1.followed_posts()))
+        self.assertEqual(set(u1.home_timeline().all()), {p1, p2, p3})
+        self.assertEqual(u2.home_timeline().all(), [p1])
+        self.assertEqual(u3.home_timeline().all(), [p2])
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(set(u1.home_timeline().all()), {p2, p3})
+
+    def test_hybrid_feed(self):
+        self.app.config['FEED_CELEBRITY_THRESHOLD'] = 2
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        # susan has two followers, which makes her a celebrity
+        u1.follow(u2)
+        u3.follow(u2)
+        u1.follow(u3)
+        db.session.commit()
+        self.assertTrue(u2.is_celebrity())
+        self.assertFalse(u3.is_celebrity())
+
+        posts = []
+        for i in range(6):
+            author = [u1, u2, u3][i % 3]
+            posts.append(author.publish('post {}'.format(i)))
+        db.session.commit()
+
+        # celebrity posts are not pushed, they are merged in at read time
+        self.assertNotIn(posts[1], u1.home_timeline().all())
+        self.assertEqual(list(HybridFeed(u1)), posts[::-1])
+        self.assertEqual(list(HybridFeed(u1)), list(u1.followed_posts()))
+
+        page1 = HybridFeed(u1).paginate(1, 4, False)
+        self.assertEqual(page1.items, posts[:1:-1])
+        self.assertTrue(page1.has_next)
+        page2 = HybridFeed(u1).paginate(2, 4, False)
+        self.assertEqual(page2.items, posts[1::-1])
+        self.assertFalse(page2.has_next)
+
+    def test_hybrid_feed_demotion(self):
+        self.app.config['FEED_CELEBRITY_THRESHOLD'] = 2
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u3)
+        db.session.commit()
+        p1 = u3.publish('before mary was a celebrity') # pushed to john
+        db.session.commit()
+
+        u2.follow(u3) # mary becomes a celebrity
+        db.session.commit()
+        p2 = u3.publish('while mary was a celebrity') # only pulled
+        db.session.commit()
+        self.assertEqual(list(HybridFeed(u1)), [p2, p1])
+
+        # back below the threshold, her posts have to be in john's timeline now
+        u2.unfollow(u3)
+        db.session.commit()
+        self.assertFalse(u3.is_celebrity())
+        self.assertEqual(list(HybridFeed(u1)), [p2, p1])
+        self.assertEqual(list(HybridFeed(u1)), list(u1.followed_posts()))
+        self.assertEqual(u1.home_timeline().all(), [p2, p1])
+        self.assertEqual(u2.home_timeline().all(), [])
+
+    def test_search(self):
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(u1)
+        db.session.commit()
+        p1 = u1.publish('the quick brown fox')
+        p2 = u1.publish('a fox, another fox and a third fox')
+        p3 = u1.publish('nothing to see here')
+        p4 = u1.publish('brown bears')
+        db.session.commit()
+
+        # best match first, all the words have to match
+        self.assertEqual(Post.search('fox').items, [p2, p1])
+        self.assertEqual(Post.search('brown fox').items, [p1])
+        self.assertEqual(Post.search('"); DROP').items, [])
+        self.assertEqual(Post.search('').items, [])
+
+        # keyset pages over the ranking
+        page = Post.search('fox', per_page=1)
+        self.assertEqual(page.items, [p2])
+        page = Post.search('fox', page.next_cursor, per_page=1)
+        self.assertEqual(page.items, [p1])
+        self.assertFalse(page.has_next)
+        self.assertEqual(Post.search('fox', page.prev_cursor, per_page=1).items, [p2])
+
+        # the triggers keep the index in step with the post table
+        p4.body = 'black bears'
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual(Post.search('fox').items, [p2])
+        self.assertEqual(Post.search('black').items, [p4])
+        self.assertEqual(Post.search('brown').items, [])
+
+        # rebuilding from scratch gives the same results
+        db.session.execute("INSERT INTO post_fts (post_fts) VALUES ('delete-all')")
+        self.assertEqual(Post.search('bears').items, [])
+        self.assertEqual(Post.rebuild_search_index(0, 1), p2.id)
+        self.assertEqual(Post.rebuild_search_index(p2.id, 10), p4.id)
+        self.assertIsNone(Post.rebuild_search_index(p4.id, 10))
+        self.assertEqual(Post.search('bears').items, [p4])
+
+    def test_space_saving(self):
+        summary = SpaceSaving(3)
+        for tag in 'a b a c a b d e a'.split():
+            summary.add(tag)
+        self.assertEqual(len(summary.counts), 3) # memory stays fixed
+        self.assertEqual(summary.top(1), [('a', 4)])
+
+    def test_trending_tags(self):
+        self.app.config['TRENDING_WINDOW'] = 60
+        self.app.config['TRENDING_BUCKETS'] = 6
+        self.assertEqual(hashtags('#Flask and #python, #flask!'), {'flask', 'python'})
+        start = 600000
+        trending = TrendingTags()
+        trending.add({'flask', 'python'}, now=start)
+        trending.add({'flask'}, now=start + 15)
+        trending.add({'sql'}, now=start + 45)
+        self.assertEqual(trending.top(2, now=start + 50), [('flask', 2), ('python', 1)])
+        # the first slice slides out of the window
+        self.assertEqual(trending.top(5, now=start + 65), [('flask', 1), ('sql', 1)])
+
+        # a restart picks up the last snapshot
+        trending.snapshot()
+        restored = TrendingTags()
+        self.assertEqual(restored.top(5, now=start + 65), [('flask', 1), ('sql', 1)])
+
+    def test_recent_posts(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        now = datetime.utcnow()
+        for i in range(6):
+            db.session.add(Post(body='post {}'.format(i), author=u,
+                                timestamp=now + timedelta(seconds=i)))
+        db.session.commit()
+        buffer = RecentPosts(size=5)
+        buffer.sync(6)
+        self.assertEqual([post.id for post in buffer.posts], [2, 3, 4, 5, 6])
+
+        with self.app.test_request_context():
+            first = buffer.page(None, 2)
+            self.assertEqual([post.body for post in first.items], ['post 5', 'post 4'])
+            self.assertEqual(first.items[0].author, u)
+            second = buffer.page(first.next_cursor, 2)
+            self.assertEqual([post.id for post in second.items], [4, 3])
+            self.assertTrue(second.has_prev)
+            self.assertEqual([post.id for post in buffer.page(second.prev_cursor, 2).items],
+                             [6, 5])
+            # the third page goes past the oldest buffered post, the database has to serve it
+            self.assertIsNone(buffer.page(second.next_cursor, 2))
+
+        # a post written by another process shows up once sync() sees a higher max id
+        other = Post(body='from another worker', author=u, timestamp=now + timedelta(seconds=9))
+        db.session.add(other)
+        db.session.commit()
+        buffer.sync(other.id)
+        self.assertEqual(buffer.posts[-1].body, 'from another worker')
+        self.assertEqual(len(buffer.posts), 5)
+        buffer.append(other) # already there
+        self.assertEqual(len(buffer.posts), 5)
+
+        # more new posts than the buffer holds: it keeps the newest, not the first ones read
+        for i in range(8):
+            db.session.add(Post(body='burst {}'.format(i), author=u,
+                                timestamp=now + timedelta(seconds=10 + i)))
+        db.session.commit()
+        newest = Post.query.order_by(Post.id.desc()).first()
+        buffer.sync(newest.id)
+        self.assertEqual([post.body for post in buffer.posts],
+                         ['burst {}'.format(i) for i in range(3, 8)])
+        with self.app.test_request_context():
+            self.assertEqual([post.body for post in buffer.page(None, 3).items],
+                             ['burst 7', 'burst 6', 'burst 5'])
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics([0.1, 1.0])
+        def worker():
+            for seconds in (0.05, 0.1, 0.5, 2.0):
+                metrics.observe('index', 'GET', 200, seconds)
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.observe('login', 'POST', 302, 0.01)
+        counts, histograms = metrics.collect()
+        # the four threads ended, their shards were folded into the retired totals
+        self.assertEqual(len(metrics.shards), 1)
+        self.assertEqual(counts, {('index', 'GET', 200): 16, ('login', 'POST', 302): 1})
+        self.assertEqual(histograms['index'][:-1], [8, 4, 4]) # <= 0.1, <= 1.0, +Inf
+        self.assertAlmostEqual(histograms['index'][-1], 4 * 2.65)
+
+        # a thread per request does not leave a shard per request behind
+        for i in range(100):
+            thread = threading.Thread(target=metrics.observe, args=('user', 'GET', 200, 0.2))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(metrics.shards), 1)
+        counts, histograms = metrics.collect()
+        self.assertEqual(counts[('user', 'GET', 200)], 100)
+        self.assertEqual(histograms['user'][:-1], [0, 100, 0])
+        metrics.clear()
+        self.assertEqual(metrics.collect(), ({}, {}))
+
+    def test_stack_sampler(self):
+        def busy_view():
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+        sampler = StackSampler(threading.get_ident(), 0.002).start()
+        busy_view()
+        sampler.stop()
+        self.assertFalse(sampler.thread.is_alive())
+        self.assertTrue(sampler.counts)
+        stack, count = sampler.counts.most_common(1)[0]
+        self.assertTrue(stack.endswith(':test_stack_sampler;{}:busy_view'.format(__name__)),
+                        stack)
+        path = os.path.join(tempfile.mkdtemp(), 'profiles', 'test.folded')
+        self.addCleanup(shutil.rmtree, os.path.dirname(os.path.dirname(path)))
+        sampler.write(path)
+        with open(path) as f:
+            self.assertEqual(f.readline(), '{} {}\n'.format(stack, count))
+
+    def test_sql_stats(self):
+        stats = SQLStats(keep=2)
+        for i in range(6):
+            stats.add('SELECT * FROM user WHERE id = ?', 0.001)
+        stats.add('SELECT * FROM post', 0.010)
+        stats.add('SELECT count(*) FROM post', 0.005)
+        self.assertEqual(stats.count, 8)
+        self.assertAlmostEqual(stats.total, 0.021)
+        self.assertEqual(stats.repeated(5), [('SELECT * FROM user WHERE id = ?', 6)])
+        self.assertEqual([statement for seconds, statement in stats.slowest_statements()],
+                         ['SELECT * FROM post', 'SELECT count(*) FROM post'])
+
+    def test_keyset_pagination(self):
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(u1)
+        now = datetime.utcnow()
+        # two posts share each timestamp, so the id has to break the ties
+        posts = [Post(body='post {}'.format(i), author=u1,
+                      timestamp=now + timedelta(seconds=i // 2)) for i in range(7)]
+        db.session.add_all(posts)
+        db.session.commit()
+        newest_first = sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)
+
+        page = keyset_paginate(Post.query, Post.timestamp, Post.id, None, 3)
+        self.assertEqual(page.items, newest_first[:3])
+        self.assertFalse(page.has_prev)
+        page = keyset_paginate(Post.query, Post.timestamp, Post.id, page.next_cursor, 3)
+        self.assertEqual(page.items, newest_first[3:6])
+        page = keyset_paginate(Post.query, Post.timestamp, Post.id, page.next_cursor, 3)
+        self.assertEqual(page.items, newest_first[6:])
+        self.assertFalse(page.has_next)
+
+        # walking back up
+        page = keyset_paginate(Post.query, Post.timestamp, Post.id, page.prev_cursor, 3)
+        self.assertEqual(page.items, newest_first[3:6])
+        page = keyset_paginate(Post.query, Post.timestamp, Post.id, page.prev_cursor, 3)
+        self.assertEqual(page.items, newest_first[:3])
+        self.assertFalse(page.has_prev)
+
+        # the hybrid feed pages the same way (following john backfills his posts)
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        db.session.commit()
+        u2.follow(u1)
+        db.session.commit()
+        page = HybridFeed(u2).keyset_paginate(None, 4)
+        self.assertEqual(page.items, newest_first[:4])
+        page = HybridFeed(u2).keyset_paginate(page.next_cursor, 4)
+        self.assertEqual(page.items, newest_first[4:])
+        self.assertFalse(page.has_next)
+        page = HybridFeed(u2).keyset_paginate(page.prev_cursor, 4)
+        self.assertEqual(page.items, newest_first[:4])
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    '''
+    Just enough of an SMTP server to accept messages, like "python -m smtpd -n -c
+    DebuggingServer" but keeping the messages and counting connections.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('localhost', 0), SMTPStandInHandler)
+        self.messages = []
+        self.connections = 0
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        data = None
+        for line in self.rfile:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    self.server.messages.append('\n'.join(data))
+                    data = None
+                    self.reply('250 OK')
+                else:
+                    data.append(line)
+            elif line.upper() == 'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif line.upper() == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class MailQueueCase(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.app = create_app(TestConfig)
+        self.app.config['MAIL_WORKERS'] = 1
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        state = self.app.extensions['mail']
+        state.server, state.port = self.server.server_address
+        state.suppress = False
+
+    def tearDown(self):
+        mail_queue.drain()
+        self.app_context.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_delivery(self):
+        sent = mail_queue.stats()['sent']
+        for i in range(5):
+            send_email('message {}'.format(i), sender='no-reply@example.com',
+                       recipients=['john@example.com'], text_body='hello', html_body='<p>hello</p>')
+        mail_queue.drain()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertIn('Subject: message 4', self.server.messages[-1])
+        # all five went over one reused connection
+        self.assertEqual(self.server.connections, 1)
+        stats = mail_queue.stats()
+        self.assertEqual(stats['sent'] - sent, 5)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_broken_message(self):
+        stats = mail_queue.stats()
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            # a newline in a header makes Flask-Mail raise BadHeaderError
+            send_email('bad\nsubject', sender='no-reply@example.com',
+                       recipients=['john@example.com'], text_body='hello', html_body='')
+            send_email('good subject', sender='no-reply@example.com',
+                       recipients=['john@example.com'], text_body='hello', html_body='')
+            mail_queue.drain()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(mail_queue.stats()['failed'] - stats['failed'], 1)
+        self.assertEqual(mail_queue.stats()['sent'] - stats['sent'], 1)
+
+    def test_dead_worker_replaced(self):
+        mail_queue.start()
+        worker = mail_queue.workers[0]
+        mail_queue.queue.put(_STOP) # the worker exits as if it had crashed
+        worker.join()
+        send_email('after the crash', sender='no-reply@example.com',
+                   recipients=['john@example.com'], text_body='hello', html_body='')
+        self.assertTrue(mail_queue.workers[0].is_alive())
+        mail_queue.drain()
+        self.assertEqual(len(self.server.messages), 1)
+
+
+class DigestCase(MailQueueCase):
+    def setUp(self):
+        MailQueueCase.setUp(self)
+        db.create_all()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'digest.checkpoint')
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u3)
+        u2.follow(u3)
+        u2.publish('post from susan')
+        u3.publish('post from mary')
+        u3.publish('another post from mary')
+        db.session.commit()
+        self.ids = [u1.id, u2.id, u3.id]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        MailQueueCase.tearDown(self)
+
+    def test_digest(self):
+        sent = send_digests(chunk_size=1, per_user=2, checkpoint=self.checkpoint)
+        self.assertEqual(sent, 2) # mary follows nobody
+        self.assertEqual(len(self.server.messages), 2)
+        john = [m for m in self.server.messages if 'To: john@example.com' in m][0]
+        self.assertIn('3 new posts', john)
+        self.assertIn('...and 1 more.', john)
+        susan = [m for m in self.server.messages if 'To: susan@example.com' in m][0]
+        self.assertIn('2 new posts', susan)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_digest_checkpoint_after_delivery(self):
+        # a kill loses whatever is still queued, so the checkpoint only moves past a chunk
+        # once its emails reached the SMTP server
+        delivered = []
+        def record(path, last_id):
+            delivered.append((last_id, len(self.server.messages)))
+            return write_checkpoint(path, last_id)
+        with patch('app.digest.write_checkpoint', side_effect=record):
+            send_digests(chunk_size=1, checkpoint=self.checkpoint)
+        self.assertEqual(delivered, [(self.ids[0], 1), (self.ids[1], 2), (self.ids[2], 2)])
+
+    def test_digest_resume(self):
+        # a previous run stopped after john
+        with open(self.checkpoint, 'w') as f:
+            f.write(str(self.ids[0]))
+        self.assertEqual(send_digests(chunk_size=1, checkpoint=self.checkpoint), 1)
+        self.assertIn('To: susan@example.com', self.server.messages[0])
+
+
+class RouteCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        self.user.set_password('cat')
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+
+    def tearDown(self):
+        last_seen_buffer.flush()
+        user_cache.clear()
+        trending_tags.clear()
+        fragment_cache.clear()
+        recent_posts.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_last_seen_buffer(self):
+        # page views do not write last_seen right away
+        before = User.query.get(self.user.id).last_seen
+        self.client.get('/index')
+        self.client.get('/explore')
+        db.session.expire_all()
+        self.assertEqual(User.query.get(self.user.id).last_seen, before)
+
+        # a flush writes only the latest value per user, in one statement
+        later = datetime.utcnow() + timedelta(minutes=5)
+        buffer = LastSeenBuffer()
+        buffer.touch(self.user.id, later - timedelta(minutes=1))
+        buffer.touch(self.user.id, later)
+        buffer.stopping.set() # keep the background flusher out of the way
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        db.session.expire_all()
+        self.assertEqual(User.query.get(self.user.id).last_seen, later)
+
+    def test_auth_urls(self):
+        # the auth pages kept their old URLs, reset links already emailed must still work
+        with self.app.test_request_context():
+            self.assertEqual(url_for('auth.login'), '/login')
+            self.assertEqual(url_for('auth.reset_password', token='abc'), '/reset_password/abc')
+        token = self.user.get_reset_password_token()
+        self.client.get('/logout')
+        self.assertEqual(self.client.get('/reset_password/' + token).status_code, 200)
+
+    def test_rehash_on_login(self):
+        self.client.get('/logout')
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        self.client.post('/login', data={'username': 'john', 'password': 'dog'})
+        self.assertFalse(User.query.get(self.user.id).password_hash.startswith(
+            'pbkdf2:sha256:1000$'))
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        user = User.query.get(self.user.id)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(user.check_password('cat'))
+
+    def test_search_route(self):
+        self.user.publish('hello search')
+        self.user.publish('goodbye')
+        db.session.commit()
+        response = self.client.get('/search?q=hello')
+        self.assertIn(b'hello search', response.data)
+        self.assertNotIn(b'goodbye', response.data)
+        self.assertEqual(self.client.get('/search').status_code, 302)
+
+    def test_trending_panel(self):
+        self.client.post('/index', data={'post': 'learning #flask'})
+        self.client.post('/index', data={'post': 'more #Flask and #sql'})
+        response = self.client.get('/explore')
+        self.assertIn(b'#flask</a> (2)', response.data)
+        self.assertIn(b'#sql</a> (1)', response.data)
+
+    def test_user_cache(self):
+        self.client.get('/index') # loads and caches the user
+        self.assertEqual(self.count_queries('/edit_profile'), 0)
+
+        # editing the profile invalidates the cached copy
+        self.client.post('/edit_profile', data={'username': 'johnny', 'about_me': 'hi'})
+        self.assertIn(b'johnny', self.client.get('/edit_profile').data)
+        self.assertEqual(self.count_queries('/edit_profile'), 0)
+        # the user came back from the cache attached to the session
+        self.assertIn(b'hi', self.client.get('/user/johnny').data)
+
+    def test_user_cache_snapshot(self):
+        # the stored row is copied as it is, the email and username validators do not run
+        db.session.execute(User.__table__.update().values(avatar_hash=None, profile_version=3))
+        db.session.commit()
+        user_cache.clear()
+        with patch('app.models.email_digest') as email_digest:
+            self.client.get('/index') # loads and caches the user
+        email_digest.assert_not_called()
+        snapshot = user_cache.get(self.user.id)
+        self.assertIsNone(snapshot.avatar_hash)
+        self.assertEqual(snapshot.profile_version, 3)
+        self.assertEqual(snapshot.username, 'john')
+
+    def test_post_fragments(self):
+        self.client.post('/index', data={'post': 'cached post'})
+        self.assertIn(b'/user/john"', self.client.get('/explore').data)
+        hits = fragment_cache.hits
+        self.client.get('/explore')
+        self.assertEqual(fragment_cache.hits, hits + 1)
+
+        # a new username gives the author a new profile_version, the old fragment is not used
+        self.client.post('/edit_profile', data={'username': 'johnny', 'about_me': ''})
+        data = self.client.get('/explore').data
+        self.assertIn(b'/user/johnny"', data)
+        self.assertNotIn(b'/user/john"', data)
+
+    def test_conditional_get(self):
+        self.client.post('/index', data={'post': 'first post'}, follow_redirects=True)
+        for url in ('/index', '/explore', '/user/john'):
+            response = self.client.get(url)
+            etag = response.headers['ETag']
+            self.assertIn('private', response.headers['Cache-Control'])
+            self.assertEqual(response.headers['Vary'], 'Cookie')
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.data, b'')
+
+        # a new post changes the validator of every page that shows it
+        etag = self.client.get('/explore').headers['ETag']
+        self.client.post('/index', data={'post': 'second post'}, follow_redirects=True)
+        response = self.client.get('/explore', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'second post', response.data)
+
+        # a waiting flashed message is never hidden behind a 304
+        etag = self.client.get('/index').headers['ETag']
+        self.client.post('/edit_profile', data={'username': 'john', 'about_me': 'hi'})
+        response = self.client.get('/index', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Your changes have been saved.', response.data)
+        response = self.client.get('/index', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_get_follow(self):
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add(susan)
+        db.session.commit()
+        etags = [self.client.get(url).headers['ETag'] for url in ('/index', '/user/susan')]
+        self.client.get('/follow/susan')
+        self.client.get('/index') # shows the flashed message
+        for url, etag in zip(('/index', '/user/susan'), etags):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200, url)
+
+        # revalidating the home page does not load the set of followed users
+        etag = self.client.get('/index').headers['ETag']
+        queries = []
+        listen = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listen)
+        try:
+            response = self.client.get('/index', headers={'If-None-Match': etag})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listen)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries if q.startswith('SELECT followers.followed_id')],
+                         queries)
+        self.client.get('/unfollow/susan')
+        self.client.get('/index') # shows the flashed message
+        response = self.client.get('/index', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.query.get(self.user.id).follow_version, 2)
+
+        # following someone does not make the page newer, If-Modified-Since alone never 304s
+        last_modified = self.client.get('/index').headers['Last-Modified']
+        self.client.get('/follow/susan')
+        self.client.get('/index') # shows the flashed message
+        response = self.client.get('/index', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 200)
+
+    def test_export(self):
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add(susan)
+        db.session.commit()
+        self.client.get('/follow/susan')
+        for i in range(3):
+            self.client.post('/index', data={'post': 'post {}'.format(i)})
+
+        response = self.client.get('/api/users/john/posts')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        posts = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([post['body'] for post in posts], ['post 0', 'post 1', 'post 2'])
+        self.assertTrue(posts[0]['timestamp'].endswith('Z'))
+
+        lines = self.client.get('/api/users/susan/followers').data.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': self.user.id, 'username': 'john'}])
+        lines = self.client.get('/api/users/john/following').data.decode().splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines], ['susan'])
+        self.assertEqual(self.client.get('/api/users/susan/following').data, b'')
+        self.assertEqual(self.client.get('/api/users/nobody/posts').status_code, 404)
+
+    def test_sql_profiler(self):
+        self.app.config['SQL_PROFILER_HEADERS'] = True
+        self.add_authors(0, 3)
+        self.client.get('/explore')
+        response = self.client.get('/explore')
+        self.assertEqual(int(response.headers['X-SQL-Queries']),
+                         self.count_queries('/explore'))
+        self.assertEqual(response.headers['X-SQL-Repeated'], '0')
+        self.assertTrue(response.headers['X-SQL-Time'].endswith(' ms'))
+
+        # an N+1 page: _post.html lazy loads every author when they are not preloaded
+        self.app.config['SQL_REPEATED_THRESHOLD'] = 3
+        self.app.config['SQL_SLOW_REQUEST_MS'] = 0
+        with patch.object(Post, 'preload_authors', staticmethod(lambda posts: posts)):
+            with self.assertLogs(self.app.logger, 'WARNING') as logs:
+                response = self.client.get('/explore?page=1')
+        self.assertEqual(response.headers['X-SQL-Repeated'], '1')
+        self.assertIn('Slow request GET /explore', logs.output[0])
+        self.assertIn('repeated 3 times', logs.output[0])
+
+    def test_metrics_endpoint(self):
+        request_metrics.clear()
+        self.client.get('/index')
+        self.client.get('/explore')
+        self.client.get('/user/nobody')
+        data = self.client.get('/metrics').data.decode()
+        self.assertIn('microblog_requests_total{endpoint="main.index",method="GET",status="200"} 1',
+                      data)
+        self.assertIn('microblog_requests_total{endpoint="main.user",method="GET",status="404"} 1',
+                      data)
+        self.assertIn('microblog_request_duration_seconds_bucket{endpoint="main.explore",le="+Inf"} 1',
+                      data)
+        self.assertIn('# TYPE microblog_mail_queue_depth gauge', data)
+        self.assertIn('microblog_user_cache_hit_ratio ', data)
+
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_request(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config['PROFILER_DIR'] = directory
+        response = self.client.get('/explore?profile=1')
+        self.assertNotIn('X-Profile-File', response.headers) # john is not an admin
+        self.assertEqual(os.listdir(directory), [])
+
+        self.app.config['ADMINS'] = ['john@example.com']
+        response = self.client.get('/explore', headers={'X-Profile': '1'})
+        name = response.headers['X-Profile-File']
+        self.assertTrue(name.endswith('.folded') and '-main.explore-' in name, name)
+        self.assertEqual(os.listdir(directory), [name])
+
+        self.app.config['ADMINS'] = []
+        self.app.config['PROFILER_SAMPLE_RATE'] = 1.0
+        response = self.client.get('/explore')
+        self.assertNotIn('X-Profile-File', response.headers) # only admins see the file name
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def count_queries(self, url):
+        queries = []
+        listen = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listen)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listen)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_authors(self, first, last):
+        for i in range(first, last):
+            author = User(username='user{}'.format(i), email='user{}@example.com'.format(i))
+            db.session.add(author)
+            db.session.flush()
+            author.publish('post from user{}'.format(i))
+            self.user.follow(author)
+        db.session.commit()
+
+    def test_queries_per_page(self):
+        # one author on the page, then ten different ones
+        self.add_authors(0, 1)
+        urls = ('/index', '/explore', '/user/user0')
+        for url in urls: # warm up the per-process caches
+            self.client.get(url)
+        counts = {url: self.count_queries(url) for url in urls}
+        self.add_authors(1, 10)
+        self.client.get('/explore') # the recent posts buffer catches up with the new posts
+        for url, count in counts.items():
+            self.assertEqual(self.count_queries(url), count, url)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
 